@@ -0,0 +1,120 @@
+"""
+Runs the same frames through several inference backends and compares latency and vehicle counts
+against the first one. Run from the project root:
+python -m benchmarks.backend_compare --source video.mp4 --backends torch onnx onnx-int8 --threads 4
+"""
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from core.backends import create_backend
+from core.model import resolve_model_path, vehicle_detections
+
+
+def load_frames(source: str, limit: int, stride: int) -> list[np.ndarray]:
+    image = cv2.imread(source)
+    if image is not None:
+        return [image]
+
+    frames = []
+    cap = cv2.VideoCapture(source)
+    index = 0
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % stride == 0:
+            frames.append(frame)
+        index += 1
+    cap.release()
+    return frames
+
+
+def box_agreement(reference, detections, iou_threshold: float = 0.5) -> float:
+    """Share of reference boxes matched by a box of the same class"""
+    import supervision as sv
+
+    if len(reference) == 0:
+        return 1.0 if len(detections) == 0 else 0.0
+    if len(detections) == 0:
+        return 0.0
+
+    iou = sv.box_iou_batch(reference.xyxy, detections.xyxy)
+    same_class = reference.class_id[:, None] == detections.class_id[None, :]
+    return float(((iou >= iou_threshold) & same_class).any(axis=1).mean())
+
+
+def run_backend(spec: str, model_path: str, frames: list[np.ndarray], threads: int):
+    name, _, variant = spec.partition('-')
+    overrides = {'threads': threads} if name == 'onnx' and threads else {}
+    backend = create_backend(name, model_path, int8=variant == 'int8', **overrides)
+    backend.detect([frames[0]])
+
+    latencies = []
+    detections = []
+    for frame in frames:
+        started_at = time.perf_counter()
+        result = backend.detect([frame])[0]
+        latencies.append(time.perf_counter() - started_at)
+        detections.append(vehicle_detections(result))
+    return np.array(latencies), detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inference backends on the same frames')
+    parser.add_argument('--source', required=True, help='video file or image')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'],
+                        help='torch, onnx, onnx-int8, openvino, openvino-int8, the first is the reference')
+    parser.add_argument('--model', default=None, help='.pt weights, found automatically when omitted')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--stride', type=int, default=5, help='use every Nth frame of a video')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime intra-op threads')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.frames, args.stride)
+    if not frames:
+        parser.error(f'No frames could be read from {args.source}')
+    model_path = args.model or resolve_model_path()
+
+    results = {}
+    reference = None
+    for spec in args.backends:
+        latencies, detections = run_backend(spec, model_path, frames, args.threads)
+        counts = np.array([len(d) for d in detections])
+        result = {
+            'frames': len(frames),
+            'latency_p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'latency_p95_ms': float(np.percentile(latencies, 95) * 1000),
+            'fps': float(len(latencies) / latencies.sum()),
+            'mean_vehicle_count': float(counts.mean()),
+        }
+        if reference is None:
+            reference = (counts, detections)
+        else:
+            reference_counts, reference_detections = reference
+            result['count_exact_match'] = float((counts == reference_counts).mean())
+            result['count_mean_abs_diff'] = float(np.abs(counts - reference_counts).mean())
+            result['box_agreement'] = float(np.mean([
+                box_agreement(ref, det) for ref, det in zip(reference_detections, detections)
+            ]))
+        results[spec] = result
+
+    print(f'{len(frames)} frames, reference: {args.backends[0]}')
+    for spec, result in results.items():
+        line = f"{spec:15} p50 {result['latency_p50_ms']:8.1f} ms  p95 {result['latency_p95_ms']:8.1f} ms  " \
+               f"{result['fps']:7.1f} fps  vehicles {result['mean_vehicle_count']:6.2f}"
+        if 'count_exact_match' in result:
+            line += f"  count match {result['count_exact_match']:.0%}  boxes {result['box_agreement']:.0%}"
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
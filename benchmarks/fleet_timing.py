@@ -0,0 +1,57 @@
+"""
+Compares the scalar timing functions of core/controller.py with the vectorized ones in core/fleet.py
+Run from the project root: python -m benchmarks.fleet_timing --lights 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from core.controller import get_congestion, phase_duration
+from core.fleet import CONGESTION_LEVELS, PHASES, congestion_levels, phase_durations
+
+
+def best_of(repeat: int, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scalar vs vectorized congestion and timing throughput')
+    parser.add_argument('--lights', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    counts = rng.integers(0, 30, args.lights)
+    phases = rng.integers(0, len(PHASES), args.lights)
+    count_list = counts.tolist()
+    phase_list = [PHASES[code] for code in phases]
+
+    scalar_time, scalar = best_of(args.repeat, lambda: (
+        [get_congestion(count) for count in count_list],
+        [phase_duration(phase, count) for phase, count in zip(phase_list, count_list)],
+    ))
+    vector_time, vector = best_of(args.repeat, lambda: (
+        congestion_levels(counts),
+        phase_durations(counts, phases),
+    ))
+
+    assert [CONGESTION_LEVELS[level] for level in vector[0]] == scalar[0], 'congestion levels differ'
+    assert vector[1].tolist() == scalar[1], 'phase durations differ'
+
+    print(f'lights:     {args.lights}')
+    print(f'scalar:     {scalar_time * 1000:9.2f} ms  {args.lights / scalar_time:14,.0f} lights/s')
+    print(f'vectorized: {vector_time * 1000:9.2f} ms  {args.lights / vector_time:14,.0f} lights/s')
+    print(f'speedup:    {scalar_time / vector_time:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Replays a video through the whole pipeline without the UI: decoding, vehicle counting at the phase changes the
+controller asks for, and the timing decision. Video time drives the controller, so a replay runs as fast as the
+machine allows (or at the video's frame rate with --realtime) and its decisions don't depend on the speed.
+Run from the project root:
+python -m benchmarks.pipeline --source video.mp4 --json results/pipeline.json
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+from core.config import TIMING_STATISTIC
+from core.controller import TrafficLight, IntersectionController
+from core.stats import STATISTICS
+from core.model import model_manager, count_vehicles, count_cars_from_frame
+from utils.streaming_utils import open_media_source
+
+
+class Stage:
+    """Wall and process CPU time of one pipeline stage"""
+
+    def __init__(self):
+        self.samples = []
+        self.cpu = 0.0
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.samples.append(time.perf_counter() - self._wall)
+        self.cpu += time.process_time() - self._cpu
+
+    def summary(self) -> dict:
+        samples = np.array(self.samples) * 1000
+        wall = float(samples.sum()) / 1000
+        result = {'calls': len(samples), 'wall_s': wall, 'cpu_s': self.cpu,
+                  'cpu_utilization': self.cpu / wall if wall else None}
+        if len(samples):
+            result.update({
+                'p50_ms': float(np.percentile(samples, 50)),
+                'p95_ms': float(np.percentile(samples, 95)),
+                'p99_ms': float(np.percentile(samples, 99)),
+                'max_ms': float(samples.max()),
+            })
+        return result
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if platform.system() == 'Darwin' else rss / 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def percentiles_ms(samples: list[float]) -> dict:
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None}
+    samples = np.array(samples) * 1000
+    return {f'p{p}': float(np.percentile(samples, p)) for p in (50, 95, 99)}
+
+
+def replay(source: str, max_frames: int, realtime: bool, every: int, annotate: bool,
+           statistic: str = TIMING_STATISTIC) -> dict:
+    cap = open_media_source('video', source)
+    if not isinstance(cap, cv2.VideoCapture):
+        raise SystemExit(f'Could not open {source}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+
+    video_time = {'value': 0.0}
+    # The light takes the controller's video clock, its count window is judged in video time as well
+    light = TrafficLight('replay', statistic=statistic)
+    intersection = IntersectionController('replay', [[light]], clock=lambda: video_time['value'])
+
+    decode, inference, decision = Stage(), Stage(), Stage()
+    end_to_end = []
+    transitions = 0
+    decisions = []
+    frames = 0
+    started_at = time.perf_counter()
+
+    while frames < max_frames:
+        captured_at = time.perf_counter()
+        with decode:
+            ret, frame = cap.read()
+        if not ret:
+            break
+        video_time['value'] = frames / fps
+        frames += 1
+
+        # What the event loop's scheduled transitions would have done by this point of the video
+        while video_time['value'] >= intersection.state_start_time + intersection.get_max_time():
+            intersection.advance_phase()
+            transitions += 1
+
+        if not light.detection_needed and not (every and frames % every == 0):
+            if realtime:
+                time.sleep(max(0.0, started_at + frames / fps - time.perf_counter()))
+            continue
+
+        light.detection_needed = False
+        with inference:
+            count = count_cars_from_frame(frame)[0] if annotate else count_vehicles(frame)
+        with decision:
+            light.update_vehicle_count(count, video_time['value'])
+            max_time = intersection.calculate_and_store_max_time()
+        end_to_end.append(time.perf_counter() - captured_at)
+        decisions.append({'time': round(video_time['value'], 3), 'color': intersection.color,
+                          'count': count, 'timing_count': light.timing_count(), 'max_time': max_time})
+
+        if realtime:
+            time.sleep(max(0.0, started_at + frames / fps - time.perf_counter()))
+
+    cap.release()
+    elapsed = time.perf_counter() - started_at
+    return {
+        'frames': frames,
+        'video_seconds': frames / fps,
+        'elapsed_s': elapsed,
+        'replay_speed': frames / fps / elapsed if elapsed else None,
+        'decode_fps': len(decode.samples) / sum(decode.samples) if decode.samples else None,
+        'transitions': transitions,
+        'detections': len(inference.samples),
+        'stages': {'decode': decode.summary(), 'inference': inference.summary(), 'decision': decision.summary()},
+        'end_to_end_ms': percentiles_ms(end_to_end),
+        'max_rss_mb': max_rss_mb(),
+        'decisions': decisions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless replay of a video through detection and timing')
+    parser.add_argument('--source', required=True, help='video file')
+    parser.add_argument('--frames', type=int, default=10_000, help='stop after this many frames')
+    parser.add_argument('--realtime', action='store_true', help='pace frames at the video frame rate')
+    parser.add_argument('--every', type=int, default=0,
+                        help='also count every Nth frame, 0 only counts when the controller asks (like the app)')
+    parser.add_argument('--model', default=None, help='weights, found automatically when omitted')
+    parser.add_argument('--annotate', action='store_true', help='draw the boxes too (count_cars_from_frame)')
+    parser.add_argument('--statistic', choices=STATISTICS, default=TIMING_STATISTIC,
+                        help=f'statistic of recent counts the timing uses, default {TIMING_STATISTIC}')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    if args.model:
+        model_manager.model_path = args.model
+    with Stage() as model_load:
+        model_manager.load()
+    if not model_manager.is_ready():
+        raise SystemExit(f'Model failed to load: {model_manager.error}')
+    rss_after_load = max_rss_mb()
+
+    results = replay(args.source, args.frames, args.realtime, args.every, args.annotate, args.statistic)
+    results.update({
+        'source': args.source,
+        'realtime': args.realtime,
+        'every': args.every,
+        'annotate': args.annotate,
+        'statistic': args.statistic,
+        'model': model_manager.status(),
+        'model_load_s': model_load.samples[0],
+        'max_rss_after_load_mb': rss_after_load,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+
+    stages = results['stages']
+    print(f"{results['frames']} frames ({results['video_seconds']:.1f}s of video) in {results['elapsed_s']:.2f}s, "
+          f"{results['replay_speed']:.1f}x real time")
+    print(f"decode rate: {results['decode_fps']:7.1f} fps")
+    for name, stage in stages.items():
+        if stage['calls']:
+            print(f"{name + ':':11} p50 {stage['p50_ms']:8.2f} ms  p95 {stage['p95_ms']:8.2f} ms  "
+                  f"p99 {stage['p99_ms']:8.2f} ms  cpu {stage['cpu_s']:7.2f} s")
+    end_to_end = results['end_to_end_ms']
+    if end_to_end['p50'] is not None:
+        print(f"end to end: p50 {end_to_end['p50']:8.2f} ms  p95 {end_to_end['p95']:8.2f} ms  "
+              f"p99 {end_to_end['p99']:8.2f} ms")
+    print(f"statistic {args.statistic}, transitions {results['transitions']}, detections {results['detections']}, "
+          f"max rss {results['max_rss_mb']:.0f} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
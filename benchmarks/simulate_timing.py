@@ -0,0 +1,82 @@
+"""
+Simulates many intersections under the controller's timing and under alternative timing policies, on the same
+random arrivals, and compares delay, queue length and throughput (core/simulator.py).
+Run from the project root:
+python -m benchmarks.simulate_timing --intersections 5000 --hours 1 --thresholds 3,8,12 --multipliers 0,0.3,0.6,1.0
+"""
+import argparse
+import json
+
+import numpy as np
+
+from core.controller import congestion_multipliers, lights
+from core.fleet import CONGESTION_LEVELS, CONGESTION_THRESHOLDS
+from core.simulator import TrafficSimulator
+
+COLUMNS = ('avg_delay_seconds', 'avg_queue', 'p95_max_queue', 'throughput_per_hour', 'residual_queue')
+
+
+def parse_numbers(text: str, count: int, name: str) -> list[float]:
+    values = [float(value) for value in text.split(',')]
+    if len(values) != count:
+        raise SystemExit(f'--{name} needs {count} comma separated values')
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing policies compared on a simulated fleet of intersections')
+    parser.add_argument('--intersections', type=int, default=5000)
+    parser.add_argument('--groups', type=int, default=2, help='Phase groups (approaches) per intersection')
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--min-rate', type=float, default=0.02, help='Arrivals per second of the quietest approach')
+    parser.add_argument('--max-rate', type=float, default=0.15, help='Arrivals per second of the busiest approach')
+    parser.add_argument('--saturation-flow', type=float, default=0.5, help='Departures per second while green')
+    parser.add_argument('--max-visible', type=int, help='Most vehicles the camera can count on one approach')
+    parser.add_argument('--thresholds',
+                        help=f'Congestion thresholds, default {",".join(map(str, CONGESTION_THRESHOLDS))}')
+    parser.add_argument('--multipliers', help=f'Multipliers of {",".join(CONGESTION_LEVELS)}')
+    parser.add_argument('--green', type=int, help=f'Base green time, default {lights["green"]}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    policies = {
+        'controller': {},
+        # Every count gets the base times: what the adaptive timing is measured against
+        'fixed': {'multipliers': dict.fromkeys(CONGESTION_LEVELS, 0)},
+    }
+    candidate = {}
+    if args.thresholds:
+        candidate['thresholds'] = parse_numbers(args.thresholds, len(CONGESTION_THRESHOLDS), 'thresholds')
+    if args.multipliers:
+        candidate['multipliers'] = dict(
+            zip(CONGESTION_LEVELS, parse_numbers(args.multipliers, len(CONGESTION_LEVELS), 'multipliers')))
+    if args.green:
+        candidate['base_times'] = {**lights, 'green': args.green}
+    if candidate:
+        policies['candidate'] = candidate
+
+    rates = np.random.default_rng(args.seed).uniform(args.min_rate, args.max_rate, (args.intersections, args.groups))
+    results = {}
+    for name, policy in policies.items():
+        # Same seed for every policy, they all see the same arrivals
+        simulator = TrafficSimulator(rates, saturation_flow=args.saturation_flow, max_visible=args.max_visible,
+                                     policy=policy, seed=args.seed)
+        results[name] = simulator.run(args.hours * 3600)
+
+    first = next(iter(results.values()))
+    print(f'intersections: {args.intersections} x {args.groups} approaches, {args.hours:g} h simulated')
+    print(f'controller:    thresholds {CONGESTION_THRESHOLDS.tolist()}, multipliers {congestion_multipliers}')
+    print(f'{"policy":<12}' + ''.join(f'{column:>22}' for column in COLUMNS) + f'{"wall s":>10}')
+    for name, summary in results.items():
+        print(f'{name:<12}' + ''.join(f'{summary[column]:>22,.2f}' for column in COLUMNS)
+              + f'{summary["wall_seconds"]:>10.2f}')
+    print(f'speedup over real time: {first["speedup"]:,.0f} intersection-seconds per second')
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'args': vars(args), 'policies': policies, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,29 @@
 from nicegui import ui
 
+from core.model import model_manager
+
+model_state_badges = {
+    'idle': ('Model not loaded', 'grey'),
+    'loading': ('Model loading', 'orange'),
+    'ready': ('Model ready', 'green'),
+    'failed': ('Model failed to load', 'red'),
+}
+
 
 def header():
     with ui.header().style(
             'background-color: white; box-shadow: 0 1px 3px rgba(0,0,0,0.1); width: 100%; height: 64px;'):
         with ui.row().classes('items-center q-gutter-md'):
-            ui.label('Smart Traffic light flow optimization').classes('text-primary text-h5 text-weight-bold')
\ No newline at end of file
+            ui.label('Smart Traffic light flow optimization').classes('text-primary text-h5 text-weight-bold')
+            model_badge = ui.badge()
+
+        def update_model_badge():
+            text, color = model_state_badges[model_manager.state]
+            model_badge.text = text
+            model_badge.props(f'color={color}')
+            # Nothing changes anymore once loading finished
+            if model_manager.state in ('ready', 'failed'):
+                model_timer.deactivate()
+
+        model_timer = ui.timer(1, update_model_badge)
+        update_model_badge()
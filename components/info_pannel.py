@@ -1,36 +1,32 @@
-import asyncio
-
 from nicegui import ui
 
-from core.controller import get_time_remaining, get_max_time, get_current_color, traffic_light_running, \
-    traffic_light_state_machine, should_trigger_detection, count, update_vehicle_count, calculate_and_store_max_time, \
-    clear_detection_flag, get_congestion
-from core.model import count_cars_from_frame
-from components.traffic_lights import yellow_blink_state, create_traffic_light
+from core.controller import get_time_remaining, get_max_time, get_current_color, is_traffic_light_running, \
+    start_traffic_light, get_vehicle_count, get_lane_counts, get_congestion
+from components.traffic_lights import TrafficLightWidget
+from utils.metrics import UI_UPDATE_SECONDS
 
+congestion_colors = {
+    'low': 'green',
+    'medium': 'yellow',
+    'high': 'orange',
+    'very_high': 'red'
+}
 
-@ui.refreshable
-def light_text():
-    max_time = get_max_time()
-    with ui.row().classes('justify-between items-center').style(
-            'padding: 0.75rem; background-color: #f9fafb; border-radius: 0.5rem;'):
-        current_color = get_current_color()
-        ui.label(f'{current_color.capitalize()} Time:').classes('text-body2 text-weight-medium')
-        ui.label(f'{max_time}s').classes('text-body2 text-weight-bold')
 
-
-@ui.refreshable
-def vehicle_detected_label(count: int = 0):
+def info_row(title: str, value: str, value_classes: str = 'text-h6 text-weight-bold'):
     with ui.row().classes('justify-between items-center').style(
             'padding: 0.75rem; background-color: #f9fafb; border-radius: 0.5rem;'):
-        ui.label('Vehicles Detected:').classes('text-body2 text-weight-medium')
-        ui.label(f"{count}").classes('text-h6 text-weight-bold')
+        title_label = ui.label(title).classes('text-body2 text-weight-medium')
+        value_label = ui.label(value).classes(value_classes)
+    return title_label, value_label
 
 
-def info_panel(current_frame):
+def info_panel(traffic_light: TrafficLightWidget):
     with ui.column().classes('q-mt-lg q-gutter-md').style('width: 100%;'):
 
-        vehicle_detected_label(count["value"])
+        _, vehicle_count_label = info_row('Vehicles Detected:', f'{get_vehicle_count()}')
+        # Per lane breakdown, only shown when lanes are configured for the source
+        lanes_label = ui.label('').classes('text-caption text-grey-7').style('padding: 0 0.75rem;')
 
         congestion_row = ui.row().classes('justify-between items-center').style(
             'padding: 0.75rem; background-color: #f9fafb; border-radius: 0.5rem;')
@@ -38,67 +34,49 @@ def info_panel(current_frame):
             ui.label('Congestion Level:').classes('text-body2 text-weight-medium')
             congestion_badge = ui.badge('Low', color='green')
 
-        with ui.row().classes('justify-between items-center').style(
-                'padding: 0.75rem; background-color: #f9fafb; border-radius: 0.5rem;'):
-            ui.label('Time Remaining:').classes('text-body2 text-weight-medium')
-            remaining_label = ui.label('0s').classes('text-h6 text-weight-bold').style('color: #2563eb;')
+        _, remaining_label = info_row('Time Remaining:', '0s')
+        remaining_label.style('color: #2563eb;')
+
+        light_title_label, light_time_label = info_row(
+            f'{get_current_color().capitalize()} Time:', f'{get_max_time()}s', 'text-body2 text-weight-bold')
 
-        light_text()
+        # Last values sent to the browser, elements are only touched when these change
+        shown = {'congestion': 'low'}
 
-        # Track previous color to detect transitions
-        previous_color = {'value': None}
+        def set_text(label, text: str):
+            if label.text != text:
+                label.text = text
 
-        # Timer to update UI components
+        # Timer to update UI components, phase changes and detection are driven by the controller itself
+        @UI_UPDATE_SECONDS.time()
         def update_ui():
             # Start traffic light if not already running
-            if not traffic_light_running['value']:
-                asyncio.create_task(traffic_light_state_machine())
+            if not is_traffic_light_running():
+                start_traffic_light()
             current_color = get_current_color()
 
-            # Trigger detection on color change for red and green
-            if should_trigger_detection() and current_frame['value'] is not None:
-                # Run detection only when color changes to red or green
-                vehicle_count, _ = count_cars_from_frame(current_frame['value'])
-                update_vehicle_count(vehicle_count)
-                # Calculate and store max time based on detected count
-                calculate_and_store_max_time()
-                # Clear the detection flag
-                clear_detection_flag()
-
-            congestion = get_congestion(count['value'])
-
-            # Reset blink state when transitioning to yellow (starts visible)
-            if current_color == 'yellow' and previous_color['value'] != 'yellow':
-                yellow_blink_state['value'] = True
-            # Toggle blink state for yellow light while it's active
-            elif current_color == 'yellow':
-                yellow_blink_state['value'] = not yellow_blink_state['value']
-
-            previous_color['value'] = current_color
-
-            # Update traffic light
-            create_traffic_light.refresh(current_color)
+            # Update traffic light, only lamps that changed are restyled (yellow blinks on every tick)
+            traffic_light.update(current_color)
 
             # Update vehicle count
-            vehicle_detected_label.refresh(count['value'])
+            vehicle_count = get_vehicle_count()
+            set_text(vehicle_count_label, f"{vehicle_count}")
+            lane_counts = get_lane_counts()
+            set_text(lanes_label, '  ·  '.join(f'{lane} {lane_count}' for lane, lane_count in lane_counts.items()))
 
             # Update congestion badge
-            congestion_colors = {
-                'low': 'green',
-                'medium': 'yellow',
-                'high': 'orange',
-                'very_high': 'red'
-            }
-            congestion_text = congestion.replace('_', ' ').title()
-            congestion_badge.text = congestion_text
-            congestion_badge.props(f'color={congestion_colors.get(congestion, "green")}')
+            congestion = get_congestion(vehicle_count)
+            if congestion != shown['congestion']:
+                shown['congestion'] = congestion
+                congestion_badge.text = congestion.replace('_', ' ').title()
+                congestion_badge.props(f'color={congestion_colors.get(congestion, "green")}')
 
             # Update time remaining
-            remaining = get_time_remaining()
-            remaining_label.text = f'{remaining}s'
+            set_text(remaining_label, f'{get_time_remaining()}s')
 
             # Update light text
-            light_text.refresh()
+            set_text(light_title_label, f'{current_color.capitalize()} Time:')
+            set_text(light_time_label, f'{get_max_time()}s')
 
-        # Use faster update interval for blinking effect (250ms for smooth blinking)
-        ui.timer(0.5, update_ui)  # Update every 250ms for smooth blinking
+        # 500ms so the yellow light blinks once per second
+        ui.timer(0.5, update_ui)
@@ -1,58 +1,64 @@
 from nicegui import ui
 
-def light_component(bg: str, opacity: float, shadow: str, with_margin: bool = True):
-    ui.button().style(
+LIGHT_COLORS = {
+    'red': ('#ef4444', 'rgba(239, 68, 68, 0.8)'),
+    'yellow': ('#eab308', 'rgba(234, 179, 8, 0.8)'),
+    'green': ('#22c55e', 'rgba(34, 197, 94, 0.8)'),
+}
+INACTIVE_COLOR = '#4b5563'
+
+
+def light_style(bg: str, opacity: float, shadow: str, with_margin: bool = True) -> str:
+    return (
         f'width: 80px; height: 80px; border-radius: 50%; '
         f'background-color: {bg} !important; opacity: {opacity}; '
         f'box-shadow: {shadow}; {"margin-bottom: 1rem" if with_margin else ""};')
 
 
-yellow_blink_state = {'value': False}
-
-@ui.refreshable
-def create_traffic_light(state: str = 'red'):
-    red_active = '#ef4444'
-    red_inactive = '#4b5563'
-    yellow_active = '#eab308'
-    yellow_inactive = '#4b5563'
-    green_active = '#22c55e'
-    green_inactive = '#4b5563'
-
-    # Traffic light container
-    with ui.column().classes('items-center gap-4'):
-        with ui.card().style('background-color: #1f2937; padding: 2rem; border-radius: 1rem;'):
-
-            red_bg = red_active if state == 'red' else red_inactive
-            red_opacity = 1 if state == 'red' else 0.3
-            red_shadow = '0 0 20px rgba(239, 68, 68, 0.8)' if state == 'red' else 'none'
-
-            light_component(
-                bg=red_bg,
-                opacity=red_opacity,
-                shadow=red_shadow,
-            )
-
-            yellow_bg = yellow_active if state == 'yellow' else yellow_inactive
-            if state == 'yellow':
-                yellow_opacity = 1.0 if yellow_blink_state['value'] else 0.3
-                yellow_shadow = '0 0 20px rgba(234, 179, 8, 0.8)' if yellow_blink_state['value'] else 'none'
-            else:
-                yellow_opacity = 0.3
-                yellow_shadow = 'none'
-
-            light_component(
-                bg=yellow_bg,
-                opacity=yellow_opacity,
-                shadow=yellow_shadow,
-            )
-
-            green_bg = green_active if state == 'green' else green_inactive
-            green_opacity = 1 if state == 'green' else 0.3
-            green_shadow = '0 0 20px rgba(34, 197, 94, 0.8)' if state == 'green' else 'none'
-
-            light_component(
-                bg=green_bg,
-                opacity=green_opacity,
-                shadow=green_shadow,
-                with_margin=False
-            )
+def light_component(bg: str, opacity: float, shadow: str, with_margin: bool = True):
+    return ui.button().style(light_style(bg, opacity, shadow, with_margin))
+
+
+class TrafficLightWidget:
+    """
+    Traffic light built once, later updates only restyle the lamps whose look actually changed
+    instead of rebuilding the card, so an unchanged light sends nothing to the browser.
+    """
+
+    def __init__(self, state: str = 'red'):
+        self.state = None
+        self.blink_on = True
+        self._lamps = {}
+        self._styles = {}
+
+        # Traffic light container
+        with ui.column().classes('items-center gap-4'):
+            with ui.card().style('background-color: #1f2937; padding: 2rem; border-radius: 1rem;'):
+                for color in LIGHT_COLORS:
+                    style = self._lamp_style(color, state)
+                    self._lamps[color] = light_component(*style)
+                    self._styles[color] = style
+
+        self.state = state
+
+    def _lamp_style(self, color: str, state: str) -> tuple:
+        active_bg, glow = LIGHT_COLORS[color]
+        with_margin = color != 'green'
+        if color != state:
+            return INACTIVE_COLOR, 0.3, 'none', with_margin
+
+        # Yellow blinks while it's active, the others stay lit
+        lit = self.blink_on if color == 'yellow' else True
+        return active_bg, 1 if lit else 0.3, f'0 0 20px {glow}' if lit else 'none', with_margin
+
+    def update(self, state: str):
+        if state == 'yellow':
+            # Starts visible when turning yellow, then toggles on every update
+            self.blink_on = True if self.state != 'yellow' else not self.blink_on
+        self.state = state
+
+        for color, lamp in self._lamps.items():
+            style = self._lamp_style(color, state)
+            if style != self._styles[color]:
+                lamp.style(replace=light_style(*style))
+                self._styles[color] = style
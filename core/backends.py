@@ -0,0 +1,203 @@
+import ast
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from core.config import INFERENCE_IMAGE_SIZE, INFERENCE_THREADS, DETECTION_CONFIDENCE, DETECTION_IOU
+
+
+def empty_detections():
+    """No detections, with the class_name data every backend returns so labelling needs no special case"""
+    import supervision as sv
+
+    return sv.Detections(
+        xyxy=np.empty((0, 4), dtype=np.float32),
+        confidence=np.empty(0, dtype=np.float32),
+        class_id=np.empty(0, dtype=int),
+        data={'class_name': np.array([], dtype=str)},
+    )
+
+
+class UltralyticsBackend:
+    """PyTorch .pt weights, or any format ultralytics can load itself (OpenVINO model directory, ...)"""
+
+    name = 'torch'
+
+    def __init__(self, model_path: str, image_size: int = 640, confidence: float = 0.25, iou: float = 0.7):
+        from ultralytics import YOLO
+
+        self.model_path = model_path
+        self.image_size = image_size
+        self.confidence = confidence
+        self.iou = iou
+        self.model = YOLO(model_path, task='detect')
+
+    def detect(self, frames: list[np.ndarray]) -> list:
+        import supervision as sv
+
+        results = self.model(frames, verbose=False, imgsz=self.image_size, conf=self.confidence, iou=self.iou)
+        return [sv.Detections.from_ultralytics(result) for result in results]
+
+
+class OpenVINOBackend(UltralyticsBackend):
+
+    name = 'openvino'
+
+    def __init__(self, model_path: str, int8: bool = False, **kwargs):
+        super().__init__(export_openvino(model_path, int8, kwargs.get('image_size', 640)), **kwargs)
+
+
+class OnnxRuntimeBackend:
+    """
+    Runs the exported YOLOv8 ONNX graph directly on ONNX Runtime: letterbox, one session.run per batch,
+    then box decoding and per-class NMS with OpenCV. Only numpy, cv2 and onnxruntime on the hot path.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_path: str, int8: bool = False, threads: int = 0, image_size: int = 640,
+                 confidence: float = 0.25, iou: float = 0.7):
+        import onnxruntime as ort
+
+        if not model_path.endswith('.onnx'):
+            model_path = export_onnx(model_path, image_size)
+        if int8:
+            model_path = quantize_onnx(model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+
+        self.model_path = model_path
+        self.image_size = image_size
+        self.confidence = confidence
+        self.iou = iou
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        # The exported graph has a fixed batch size unless it was exported as dynamic
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.batch_size = batch_dim if isinstance(batch_dim, int) else None
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.class_names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+
+    def detect(self, frames: list[np.ndarray]) -> list:
+        if not frames:
+            return []
+
+        prepared = [letterbox(frame, self.image_size) for frame in frames]
+        blob = np.stack([image for image, _, _ in prepared])
+        blob = np.ascontiguousarray(blob[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+        if self.batch_size is None:
+            outputs = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            outputs = np.concatenate([
+                self.session.run(None, {self.input_name: blob[i:i + self.batch_size]})[0]
+                for i in range(0, len(blob), self.batch_size)
+            ])
+
+        return [
+            self._postprocess(output, frame.shape, scale, padding)
+            for output, frame, (_, scale, padding) in zip(outputs, frames, prepared)
+        ]
+
+    def _postprocess(self, output: np.ndarray, shape, scale: float, padding):
+        import supervision as sv
+
+        # (4 + classes, anchors) -> (anchors, 4 + classes), boxes are center x, center y, width, height
+        predictions = output.T
+        scores = predictions[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.confidence
+        boxes, class_ids, confidences = predictions[keep, :4], class_ids[keep], confidences[keep]
+
+        if len(boxes) == 0:
+            return empty_detections()
+
+        xywh = np.column_stack([boxes[:, 0] - boxes[:, 2] / 2, boxes[:, 1] - boxes[:, 3] / 2, boxes[:, 2], boxes[:, 3]])
+        indexes = cv2.dnn.NMSBoxesBatched(
+            xywh.tolist(), confidences.tolist(), class_ids.tolist(), self.confidence, self.iou)
+        indexes = np.asarray(indexes, dtype=int).reshape(-1)
+
+        xyxy = xywh[indexes].copy()
+        xyxy[:, 2:] += xyxy[:, :2]
+        # Undo the letterbox: remove the padding, scale back and clip to the original frame
+        xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - padding[0]) / scale).clip(0, shape[1])
+        xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - padding[1]) / scale).clip(0, shape[0])
+
+        class_ids = class_ids[indexes]
+        return sv.Detections(
+            xyxy=xyxy.astype(np.float32),
+            confidence=confidences[indexes].astype(np.float32),
+            class_id=class_ids.astype(int),
+            data={'class_name': np.array(
+                [self.class_names.get(int(class_id), str(class_id)) for class_id in class_ids])},
+        )
+
+
+def letterbox(frame: np.ndarray, size: int):
+    """Resize keeping the aspect ratio and pad to a square, like ultralytics does before inference"""
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width)
+    resized_width, resized_height = round(width * scale), round(height * scale)
+    resized = cv2.resize(frame, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+
+    left = (size - resized_width) // 2
+    top = (size - resized_height) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + resized_height, left:left + resized_width] = resized
+    return canvas, scale, (left, top)
+
+
+def export_onnx(model_path: str, image_size: int = 640) -> str:
+    """Export the .pt weights next to them once, later starts reuse the file"""
+    onnx_path = Path(model_path).with_suffix('.onnx')
+    if not onnx_path.exists():
+        from ultralytics import YOLO
+
+        exported = YOLO(model_path).export(format='onnx', imgsz=image_size, dynamic=True, simplify=True)
+        onnx_path = Path(exported)
+    return str(onnx_path)
+
+
+def quantize_onnx(onnx_path: str) -> str:
+    """Dynamic INT8 quantization of the weights, no calibration data needed"""
+    int8_path = Path(onnx_path).with_suffix('.int8.onnx')
+    if not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(onnx_path, str(int8_path), weight_type=QuantType.QUInt8)
+    return str(int8_path)
+
+
+def export_openvino(model_path: str, int8: bool = False, image_size: int = 640) -> str:
+    """INT8 export calibrates on ultralytics' default dataset, which it downloads on first use"""
+    suffix = '_int8_openvino_model' if int8 else '_openvino_model'
+    model_dir = Path(model_path).with_name(Path(model_path).stem + suffix)
+    if not model_dir.exists():
+        from ultralytics import YOLO
+
+        exported = Path(YOLO(model_path).export(format='openvino', imgsz=image_size, int8=int8))
+        if exported != model_dir:
+            exported.rename(model_dir)
+    return str(model_dir)
+
+
+def create_backend(name: str, model_path: str, int8: bool = False, **overrides):
+    """Build a backend from the config, keyword arguments override the configured options"""
+    options = {'image_size': INFERENCE_IMAGE_SIZE, 'confidence': DETECTION_CONFIDENCE, 'iou': DETECTION_IOU}
+    if name == 'torch':
+        return UltralyticsBackend(model_path, **{**options, **overrides})
+    try:
+        if name == 'onnx':
+            return OnnxRuntimeBackend(model_path, int8=int8, **{'threads': INFERENCE_THREADS, **options, **overrides})
+        if name == 'openvino':
+            return OpenVINOBackend(model_path, int8=int8, **{**options, **overrides})
+    except ImportError as e:
+        raise ImportError(f"The {name} backend needs {e.name}: pip install -r requirements-backends.txt") from e
+    raise ValueError(f"Unknown inference backend: {name}")
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from core.model import count_cars_from_frames
+
+
+class BatchDetectionEngine:
+    """
+    Collects the latest frame of every registered source and runs them through the model as one batch.
+    A batch is sent as soon as max_batch_size sources have a frame waiting, or max_wait_ms after the
+    first frame of the batch arrived. A source submitting again before its frame was processed
+    replaces it, so every source only ever waits for its newest frame.
+    Meant for deployments running several cameras in one process: the dashboard and headless mode drive
+    a single source and don't use it, nothing starts the module's batch_engine until a caller does.
+    """
+
+    def __init__(self, count_fn=count_cars_from_frames, max_batch_size: int = 8, max_wait_ms: float = 20):
+        self.count_fn = count_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+
+        self.sources = set()
+        self.latest_counts = {}
+        self._pending = {}
+        self._waiters = {}
+        self._listeners = []
+        self._frame_ready = None
+        self._task = None
+        self._executor = None
+
+        self.batches = 0
+        self.frames = 0
+        self.replaced = 0
+        self.inference_time = 0.0
+
+    def register_source(self, source_id: str):
+        self.sources.add(source_id)
+
+    def unregister_source(self, source_id: str):
+        self.sources.discard(source_id)
+        self._pending.pop(source_id, None)
+        if not self._pending and self._frame_ready is not None:
+            self._frame_ready.clear()
+        self.latest_counts.pop(source_id, None)
+        for waiter in self._waiters.pop(source_id, []):
+            if not waiter.done():
+                waiter.cancel()
+
+    def add_listener(self, callback):
+        """callback(source_id, count) is called on the event loop for every processed frame"""
+        self._listeners.append(callback)
+
+    def submit(self, source_id: str, frame):
+        if source_id not in self.sources:
+            raise KeyError(f"Unknown source: {source_id}")
+        if frame is None:
+            return
+
+        if source_id in self._pending:
+            self.replaced += 1
+        self._pending[source_id] = (frame, time.monotonic())
+        if self._frame_ready is not None:
+            self._frame_ready.set()
+
+    async def detect(self, source_id: str, frame) -> int:
+        """Submit a frame and wait for the count of this source's next processed frame"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(source_id, []).append(waiter)
+        self.submit(source_id, frame)
+        return await waiter
+
+    def start(self):
+        if self._task is None:
+            self._frame_ready = asyncio.Event()
+            if self._pending:
+                self._frame_ready.set()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-detection')
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._frame_ready.wait()
+            if not self._pending:
+                # The only waiting frame belonged to a source unregistered meanwhile
+                self._frame_ready.clear()
+                continue
+
+            # Wait for the batch to fill up, but never longer than the deadline of its oldest frame
+            oldest = min(submitted_at for _, submitted_at in self._pending.values())
+            deadline = oldest + self.max_wait
+            while len(self._pending) < self.max_batch_size and time.monotonic() < deadline:
+                self._frame_ready.clear()
+                try:
+                    await asyncio.wait_for(self._frame_ready.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+
+            batch = sorted(self._pending.items(), key=lambda item: item[1][1])[:self.max_batch_size]
+            for source_id, _ in batch:
+                del self._pending[source_id]
+            if not self._pending:
+                self._frame_ready.clear()
+            if not batch:
+                continue
+
+            source_ids = [source_id for source_id, _ in batch]
+            frames = [frame for _, (frame, _) in batch]
+
+            started_at = time.perf_counter()
+            try:
+                counts = await loop.run_in_executor(self._executor, self.count_fn, frames)
+            except Exception as e:
+                print(f"Error running batched detection: {e}")
+                for source_id in source_ids:
+                    for waiter in self._waiters.pop(source_id, []):
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                continue
+
+            self.inference_time += time.perf_counter() - started_at
+            self.batches += 1
+            self.frames += len(frames)
+
+            now = time.time()
+            for source_id, vehicle_count in zip(source_ids, counts):
+                if source_id not in self.sources:
+                    continue
+                self.latest_counts[source_id] = (vehicle_count, now)
+                for waiter in self._waiters.pop(source_id, []):
+                    if not waiter.done():
+                        waiter.set_result(vehicle_count)
+                for listener in self._listeners:
+                    try:
+                        listener(source_id, vehicle_count)
+                    except Exception as e:
+                        print(f"Error in batch detection listener: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            'sources': len(self.sources),
+            'batches': self.batches,
+            'frames': self.frames,
+            'replaced': self.replaced,
+            'avg_batch_size': self.frames / self.batches if self.batches else 0,
+            'frames_per_inference_second': self.frames / self.inference_time if self.inference_time else 0,
+        }
+
+
+batch_engine = BatchDetectionEngine(max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
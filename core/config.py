@@ -0,0 +1,93 @@
+import os
+
+# Every setting can be overridden from the environment, e.g. TRAFFIC_DETECTION_WORKERS=2 python main.py
+
+# Threads running YOLO inference for the detection service
+DETECTION_WORKERS = int(os.environ.get('TRAFFIC_DETECTION_WORKERS', '1'))
+# Requests allowed to wait for a free worker, when full the oldest waiting frame is replaced by the newest one
+DETECTION_QUEUE_SIZE = int(os.environ.get('TRAFFIC_DETECTION_QUEUE_SIZE', '1'))
+# Number of recent requests kept for latency percentiles
+DETECTION_METRICS_WINDOW = int(os.environ.get('TRAFFIC_DETECTION_METRICS_WINDOW', '200'))
+
+# Batched multi-camera engine: frames per inference call and how long to wait for a batch to fill
+BATCH_MAX_SIZE = int(os.environ.get('TRAFFIC_BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('TRAFFIC_BATCH_MAX_WAIT_MS', '20'))
+
+# YOLO weights, found automatically under models/ (or ../models/) when not set
+MODEL_PATH = os.environ.get('TRAFFIC_MODEL_PATH')
+# Run one inference on a blank frame after loading so the first real detection isn't a cold start
+MODEL_WARMUP = os.environ.get('TRAFFIC_MODEL_WARMUP', '1') == '1'
+
+# Inference runtime: 'torch' (ultralytics .pt), 'onnx' (ONNX Runtime) or 'openvino', the latter two export the .pt once
+INFERENCE_BACKEND = os.environ.get('TRAFFIC_INFERENCE_BACKEND', 'torch')
+# Quantize the exported model to INT8 (onnx and openvino only)
+INFERENCE_INT8 = os.environ.get('TRAFFIC_INFERENCE_INT8', '0') == '1'
+# Intra-op threads for ONNX Runtime, 0 keeps the runtime's default
+INFERENCE_THREADS = int(os.environ.get('TRAFFIC_INFERENCE_THREADS', '0'))
+INFERENCE_IMAGE_SIZE = int(os.environ.get('TRAFFIC_INFERENCE_IMAGE_SIZE', '640'))
+# Same defaults ultralytics uses, so every backend filters detections alike
+DETECTION_CONFIDENCE = float(os.environ.get('TRAFFIC_DETECTION_CONFIDENCE', '0.25'))
+DETECTION_IOU = float(os.environ.get('TRAFFIC_DETECTION_IOU', '0.7'))
+
+# Skip detection while the scene hasn't changed since the last one and keep the last count
+MOTION_GATE_ENABLED = os.environ.get('TRAFFIC_MOTION_GATE_ENABLED', '1') == '1'
+# Gray level difference for a pixel to count as changed, and the share of changed pixels that triggers a detection
+MOTION_PIXEL_THRESHOLD = int(os.environ.get('TRAFFIC_MOTION_PIXEL_THRESHOLD', '25'))
+MOTION_CHANGED_RATIO = float(os.environ.get('TRAFFIC_MOTION_CHANGED_RATIO', '0.01'))
+# Longest time the last count is reused without a new detection
+MOTION_MAX_SKIP_SECONDS = float(os.environ.get('TRAFFIC_MOTION_MAX_SKIP_SECONDS', '30'))
+
+# Continuous detection and tracking of video and RTSP sources, replaces the one-off detection at phase changes
+TRACKING_ENABLED = os.environ.get('TRAFFIC_TRACKING_ENABLED', '0') == '1'
+# Frames tracked per second, frames in between are skipped
+TRACKING_FPS = float(os.environ.get('TRAFFIC_TRACKING_FPS', '15'))
+# Vehicles slower than this (frame heights per second) are counted as queued
+TRACKING_QUEUE_SPEED = float(os.environ.get('TRAFFIC_TRACKING_QUEUE_SPEED', '0.02'))
+# A vehicle whose track is lost this long has left its lane
+TRACKING_LOST_SECONDS = float(os.environ.get('TRAFFIC_TRACKING_LOST_SECONDS', '2'))
+
+# Count the phase timing is based on: 'last' sample, or 'mean', 'ewma', 'median', 'p90', 'max' of recent samples
+TIMING_STATISTIC = os.environ.get('TRAFFIC_TIMING_STATISTIC', 'last')
+# Samples kept per approach, the time window the statistics cover and the EWMA half life, in seconds
+STATS_CAPACITY = int(os.environ.get('TRAFFIC_STATS_CAPACITY', '256'))
+STATS_WINDOW_SECONDS = float(os.environ.get('TRAFFIC_STATS_WINDOW_SECONDS', '120'))
+STATS_HALF_LIFE_SECONDS = float(os.environ.get('TRAFFIC_STATS_HALF_LIFE_SECONDS', '30'))
+
+# Decoding of video and RTSP sources: FFmpeg decoder threads (0 = default) and hardware decoding when available
+DECODE_THREADS = int(os.environ.get('TRAFFIC_DECODE_THREADS', '0'))
+DECODE_HW_ACCELERATION = os.environ.get('TRAFFIC_DECODE_HW_ACCELERATION', '0') == '1'
+# Convert only every Nth frame, or decode only key frames (needs the ffmpeg executable)
+DECODE_EVERY_NTH = int(os.environ.get('TRAFFIC_DECODE_EVERY_NTH', '1'))
+DECODE_KEYFRAMES_ONLY = os.environ.get('TRAFFIC_DECODE_KEYFRAMES_ONLY', '0') == '1'
+# Have FFmpeg scale while decoding to at most this width (needs the ffmpeg executable), 0 decodes at full size
+DECODE_WIDTH = int(os.environ.get('TRAFFIC_DECODE_WIDTH', '0'))
+# Frames are shown and streamed at most this wide, 0 keeps the decoded width
+DISPLAY_WIDTH = int(os.environ.get('TRAFFIC_DISPLAY_WIDTH', '1280'))
+# Longest side of the frame handed to detection, 0 detects on the display frame (better for small lane crops)
+MODEL_FRAME_SIZE = int(os.environ.get('TRAFFIC_MODEL_FRAME_SIZE', str(INFERENCE_IMAGE_SIZE)))
+
+# MJPEG stream: frames published per second, and the lowest frame rate a slow client is adapted down to
+STREAM_MAX_FPS = float(os.environ.get('TRAFFIC_STREAM_MAX_FPS', '30'))
+STREAM_MIN_FPS = float(os.environ.get('TRAFFIC_STREAM_MIN_FPS', '2'))
+# System CPU (percent) above which clients are moved to a cheaper level, and below which they may move back up
+STREAM_CPU_HIGH = float(os.environ.get('TRAFFIC_STREAM_CPU_HIGH', '85'))
+STREAM_CPU_LOW = float(os.environ.get('TRAFFIC_STREAM_CPU_LOW', '60'))
+
+# Detections of recently seen frames (repeated images, frozen cameras), 0 disables the cache
+DETECTION_CACHE_SIZE = int(os.environ.get('TRAFFIC_DETECTION_CACHE_SIZE', '128'))
+# Seconds a cached result stays valid, and the row stride of the frame fingerprint
+DETECTION_CACHE_MAX_AGE = float(os.environ.get('TRAFFIC_DETECTION_CACHE_MAX_AGE', '300'))
+DETECTION_CACHE_STRIDE = int(os.environ.get('TRAFFIC_DETECTION_CACHE_STRIDE', '2'))
+
+# Decode video and RTSP sources in a capture process and run detection in an inference process,
+# frames are shared through shared memory rings of this many slots
+PROCESS_PIPELINE = os.environ.get('TRAFFIC_PROCESS_PIPELINE', '0') == '1'
+FRAME_RING_SLOTS = int(os.environ.get('TRAFFIC_FRAME_RING_SLOTS', '8'))
+# Detections per second of the inference process
+PROCESS_INFERENCE_FPS = float(os.environ.get('TRAFFIC_PROCESS_INFERENCE_FPS', '10'))
+
+# Directory of the persistent count and phase history, empty disables it
+HISTORY_DIR = os.environ.get('TRAFFIC_HISTORY_DIR', '')
+# Seconds between writes of the queued history records, and days of history kept (0 keeps everything)
+HISTORY_FLUSH_SECONDS = float(os.environ.get('TRAFFIC_HISTORY_FLUSH_SECONDS', '1'))
+HISTORY_RETENTION_DAYS = int(os.environ.get('TRAFFIC_HISTORY_RETENTION_DAYS', '180'))
@@ -1,6 +1,8 @@
 import time
 import asyncio
 
+from core.config import TIMING_STATISTIC, STATS_CAPACITY, STATS_WINDOW_SECONDS, STATS_HALF_LIFE_SECONDS
+from core.stats import STATISTICS, RollingStats
 
 congestion_multipliers = {
     'low': 0,
@@ -15,17 +17,6 @@ lights = {
     "green": 5,
 }
 
-active_color = {'value': "red"}
-state_start_time = {'value': time.time()}
-count = {'value': 0}
-traffic_light_running = {'value': False}
-stored_max_time = {'value': None}
-detection_needed = {'value': False}
-
-def set_active_color(color: str):
-    active_color['value'] = color
-    state_start_time['value'] = time.time()
-
 def get_congestion(counter):
     if counter > 15:
         return 'very_high'
@@ -36,86 +27,290 @@ def get_congestion(counter):
     else:
         return 'low'
 
+def phase_duration(state: str, vehicle_count: int) -> int:
+    """Congestion shortens red and lengthens green, yellow never changes"""
+    congestion = get_congestion(vehicle_count)
+    multiplier = congestion_multipliers.get(congestion, 0)
+    base_time = lights.get(state, 5)
+    i = int(base_time * multiplier)
+    return base_time - i if state == "red" else i + base_time
+
+
+class TrafficLight:
+    """
+    One approach of a junction, its color is driven by the IntersectionController owning it.
+    Every count is also added to the approach's history, the timing uses the configured statistic of it.
+    Counts are timed and windowed by the owning controller's clock (time.monotonic until one takes the light).
+    With a recorder (a TimeSeriesStore) every count is persisted as well.
+    """
+
+    __slots__ = ('light_id', 'color', 'count', 'lane_counts', 'detection_needed', 'history', 'statistic', 'recorder',
+                 'clock')
+
+    def __init__(self, light_id: str, color: str = "red", statistic: str = TIMING_STATISTIC):
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown timing statistic: {statistic}")
+        self.light_id = light_id
+        self.color = color
+        self.count = 0
+        self.lane_counts = {}
+        self.detection_needed = False
+        self.history = RollingStats(STATS_CAPACITY, STATS_WINDOW_SECONDS, STATS_HALF_LIFE_SECONDS)
+        self.statistic = statistic
+        self.recorder = None
+        self.clock = time.monotonic
+
+    def update_vehicle_count(self, vehicle_count: int, timestamp: float = None):
+        self.count = vehicle_count
+        self.lane_counts = {}
+        self.history.add(vehicle_count, self.clock() if timestamp is None else timestamp)
+        if self.recorder is not None:
+            self.recorder.record_counts(self.light_id, vehicle_count, self.lane_counts)
+
+    def update_lane_counts(self, lane_counts: dict[str, int], timestamp: float = None):
+        """Counts per lane of this approach, the light's count is their total"""
+        self.lane_counts = dict(lane_counts)
+        self.count = sum(self.lane_counts.values())
+        self.history.add(self.count, self.clock() if timestamp is None else timestamp)
+        if self.recorder is not None:
+            self.recorder.record_counts(self.light_id, self.count, self.lane_counts)
+
+    def timing_count(self) -> int:
+        """Count the phase timing is based on, the last one unless a statistic of recent counts is configured"""
+        if self.statistic == 'last':
+            return self.count
+        value = self.history.value(self.statistic, self.clock())
+        return self.count if value is None else int(round(value))
+
+    def get_congestion(self) -> str:
+        return get_congestion(self.count)
+
+    def set_color(self, color: str):
+        self.color = color
+        # Red and green timings depend on the count, yellow's doesn't
+        self.detection_needed = color != "yellow"
+
+    def __repr__(self):
+        return f'TrafficLight({self.light_id!r}, {self.color!r}, count={self.count})'
+
+
+class IntersectionController:
+    """
+    Cycles the phase groups of one junction. The lights of a group always share a color,
+    the active group goes green then yellow, then the next group gets green while all others stay red.
+    A junction with a single group also runs a red phase before the group turns green again.
+    Transitions are scheduled on the event loop at their deadline, so idle junctions cost nothing.
+    With a recorder (a TimeSeriesStore) every color change is persisted.
+    """
+
+    __slots__ = ('junction_id', 'phase_groups', 'active_group', 'color', 'state_start_time', 'stored_max_time',
+                 'running', 'transition_handle', 'subscribers', 'clock', 'recorder')
+
+    def __init__(self, junction_id: str, phase_groups: list[list[TrafficLight]], clock=time.monotonic):
+        if not phase_groups or not all(phase_groups):
+            raise ValueError("An intersection needs at least one non-empty phase group")
+
+        self.junction_id = junction_id
+        self.phase_groups = [list(group) for group in phase_groups]
+        self.active_group = 0
+        self.color = "red"
+        # Monotonic so wall clock adjustments (NTP, DST) never stretch or skip a phase.
+        # Replays pass a simulated clock and call advance_phase themselves instead of start().
+        self.clock = clock
+        self.state_start_time = clock()
+        self.stored_max_time = None
+        self.running = False
+        self.transition_handle = None
+        self.subscribers = []
+        self.recorder = None
+
+        for group in self.phase_groups:
+            for light in group:
+                light.color = "red"
+                # Count timestamps must be on the same clock as the window the timing judges them by
+                light.clock = clock
+
+    @property
+    def lights(self) -> list[TrafficLight]:
+        return [light for group in self.phase_groups for light in group]
+
+    def group_count(self, group: int = None) -> int:
+        """The busiest approach of a group decides its timing"""
+        group = self.active_group if group is None else group
+        return max(light.timing_count() for light in self.phase_groups[group])
+
+    def get_max_time(self) -> int:
+        if self.stored_max_time is not None:
+            return self.stored_max_time
+
+        return self.calculate_and_store_max_time()
+
+    def calculate_and_store_max_time(self) -> int:
+        max_time = phase_duration(self.color, self.group_count())
+        changed = self.stored_max_time is not None and self.stored_max_time != max_time
+        self.stored_max_time = max_time
+        if changed:
+            # A new count made the running phase shorter or longer, move its pending transition
+            self.reschedule_transition()
+        return max_time
+
+    def get_time_remaining(self) -> int:
+        elapsed = self.clock() - self.state_start_time
+        remaining = max(0, self.get_max_time() - elapsed)
+        return int(remaining)
+
+    def set_color(self, color: str, group: int = None):
+        if group is not None:
+            self.active_group = group
+        self.color = color
+        self.state_start_time = self.clock()
+        self.stored_max_time = None
+        for light in self.phase_groups[self.active_group]:
+            light.set_color(color)
+        if self.recorder is not None:
+            self.recorder.record_phase(self.junction_id, self.active_group, color)
+
+    def advance_phase(self):
+        previous_group = self.active_group
+        previous_color = self.color
+
+        if previous_color == "green":
+            self.set_color("yellow")
+        elif previous_color == "yellow" and len(self.phase_groups) > 1:
+            self.set_color("red")
+            self.set_color("green", (previous_group + 1) % len(self.phase_groups))
+        elif previous_color == "yellow":
+            self.set_color("red")
+        else:
+            self.set_color("green")
+
+        self.reschedule_transition()
+        self.publish_transition(previous_group, previous_color)
+
+    def subscribe(self, callback):
+        """callback(event) is called on the event loop after every phase transition"""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def publish_transition(self, previous_group: int, previous_color: str):
+        if not self.subscribers:
+            return
+
+        event = {
+            'junction_id': self.junction_id,
+            'group': self.active_group,
+            'color': self.color,
+            'previous_group': previous_group,
+            'previous_color': previous_color,
+            'max_time': self.get_max_time(),
+            'lights': [light.light_id for light in self.phase_groups[self.active_group]],
+        }
+        for callback in list(self.subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Error in traffic light subscriber: {e}")
+
+    def reschedule_transition(self):
+        """Schedule the next phase change exactly at the end of the current phase instead of polling for it"""
+        if self.transition_handle is not None:
+            self.transition_handle.cancel()
+            self.transition_handle = None
+
+        if not self.running:
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = self.state_start_time + self.get_max_time()
+        # loop.time() is monotonic too, translate the deadline into the loop's clock
+        self.transition_handle = loop.call_at(loop.time() + deadline - self.clock(), self.advance_phase)
+
+    def start(self):
+        """Must be called from the event loop, transitions are scheduled on it"""
+        if not self.running:
+            self.running = True
+            self.reschedule_transition()
+
+    def stop(self):
+        self.running = False
+        self.reschedule_transition()
+
+
+# The dashboard drives a single approach, the functions below operate on it
+default_light = TrafficLight('main')
+default_intersection = IntersectionController('default', [[default_light]])
+
 def update_vehicle_count(vehicle_count: int):
-    count['value'] = vehicle_count
+    default_light.update_vehicle_count(vehicle_count)
 
-def get_max_time():
-    if stored_max_time['value'] is not None:
-        return stored_max_time['value']
+def update_lane_counts(lane_counts: dict[str, int]):
+    default_light.update_lane_counts(lane_counts)
+
+def update_counts(detections, shape, roi=None):
+    """Count of the detections, per lane when a region of interest with lanes is given"""
+    if roi is None or not roi.lanes:
+        update_vehicle_count(len(detections))
+    else:
+        update_lane_counts(roi.lane_counts(detections, shape))
+
+def get_vehicle_count():
+    return default_light.count
+
+def get_lane_counts():
+    return default_light.lane_counts
+
+def get_count_summary():
+    return default_light.history.summary()
+
+def record_history(store):
+    """Persist every count and color change of the default junction in the store, None stops recording"""
+    default_light.recorder = store
+    default_intersection.recorder = store
 
-    return calculate_and_store_max_time()
+def get_max_time():
+    return default_intersection.get_max_time()
 
 def calculate_and_store_max_time():
-    state = active_color['value']
-    congestion = get_congestion(count['value'])
-    multiplier = congestion_multipliers.get(congestion, 0)
-    base_time = lights.get(state, 5)
-    i = int(base_time * multiplier)
-    max_time = base_time - i if state == "red" else i + base_time
-    stored_max_time['value'] = max_time
-    return max_time
+    return default_intersection.calculate_and_store_max_time()
 
 def get_current_color():
-    return active_color['value']
+    return default_light.color
 
 def set_color_red():
-    active_color['value'] = "red"
-    state_start_time['value'] = time.time()
-    stored_max_time['value'] = None
-    detection_needed['value'] = True
+    default_intersection.set_color("red")
+    default_intersection.reschedule_transition()
 
 def set_color_yellow():
-    active_color['value'] = "yellow"
-    state_start_time['value'] = time.time()
-    stored_max_time['value'] = None
-    detection_needed['value'] = False
+    default_intersection.set_color("yellow")
+    default_intersection.reschedule_transition()
 
 def set_color_green():
-    active_color['value'] = "green"
-    state_start_time['value'] = time.time()
-    stored_max_time['value'] = None
-    detection_needed['value'] = True
+    default_intersection.set_color("green")
+    default_intersection.reschedule_transition()
 
 def get_time_remaining():
-    elapsed = time.time() - state_start_time['value']
-    max_time = get_max_time()
-    remaining = max(0, max_time - elapsed)
-    return int(remaining)
-
-async def traffic_light_state_machine():
-
-    traffic_light_running['value'] = True
-    
-    while traffic_light_running['value']:
-        current_state = active_color['value']
-        max_time = get_max_time()
-        elapsed = time.time() - state_start_time['value']
-        
-
-        if elapsed >= max_time:
-            if current_state == "red":
-                set_color_green()
-            elif current_state == "green":
-                set_color_yellow()
-            elif current_state == "yellow":
-                set_color_red()
-        
-        await asyncio.sleep(0.1)
+    return default_intersection.get_time_remaining()
+
+def subscribe(callback):
+    default_intersection.subscribe(callback)
+
+def unsubscribe(callback):
+    default_intersection.unsubscribe(callback)
 
 def start_traffic_light():
-    if not traffic_light_running['value']:
-        import asyncio
-        try:
-            loop = asyncio.get_running_loop()
-            loop.create_task(traffic_light_state_machine())
-        except RuntimeError:
-            asyncio.create_task(traffic_light_state_machine())
+    default_intersection.start()
 
 def stop_traffic_light():
-    traffic_light_running['value'] = False
+    default_intersection.stop()
+
+def is_traffic_light_running():
+    return default_intersection.running
 
 def should_trigger_detection():
-    return detection_needed['value']
+    return default_light.detection_needed
 
 def clear_detection_flag():
-    detection_needed['value'] = False
\ No newline at end of file
+    default_light.detection_needed = False
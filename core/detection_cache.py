@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+def frame_fingerprint(frame: np.ndarray, stride: int = 2) -> bytes:
+    """
+    128 bit BLAKE2b digest of every stride-th row, plus the frame's shape. Whole rows are hashed because
+    gathering single pixels costs more than hashing them. A repeated image or a frozen camera frame gives
+    the same digest, any real change in the scene (a vehicle spans many rows) a different one.
+    """
+    sample = np.ascontiguousarray(frame[::stride]) if stride > 1 else np.ascontiguousarray(frame)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((frame.shape, frame.dtype.str, stride)).encode())
+    digest.update(sample.data)
+    return digest.digest()
+
+
+class DetectionCache:
+    """
+    Detections of recently seen frames, keyed by frame fingerprint, model version and region of interest.
+    Least recently used entries are evicted beyond max_entries, entries older than max_age seconds are never returned.
+    Safe to use from several detection threads.
+    """
+
+    def __init__(self, max_entries: int = 128, max_age: float = 300.0, stride: int = 2):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.stride = stride
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, frame: np.ndarray, *parts) -> tuple:
+        return (frame_fingerprint(frame, self.stride), *parts)
+
+    def get(self, key) -> Optional[object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.max_age:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, frame: np.ndarray, compute, *parts):
+        """Cached value for the frame, or compute() stored under it. Callers must not modify the value."""
+        if not self.enabled:
+            return compute()
+        key = self.key(frame, *parts)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import DETECTION_WORKERS, DETECTION_QUEUE_SIZE, DETECTION_METRICS_WINDOW
+from core.model import detect_frame
+
+
+class DetectionService:
+    """
+    Runs detection in a worker pool so the event loop never waits on inference.
+    Waiting requests are bounded, when the queue is full the oldest frame is dropped
+    and its callers receive the result of the newer frame instead (latest frame wins).
+    """
+
+    def __init__(self, detect_fn, workers: int = 1, queue_size: int = 1, metrics_window: int = 200):
+        self.detect_fn = detect_fn
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self._executor = None
+        self._pending = deque()
+        self._busy = 0
+
+        self.completed = 0
+        self.superseded = 0
+        self.failed = 0
+        self._queue_wait = deque(maxlen=metrics_window)
+        self._inference_time = deque(maxlen=metrics_window)
+        self._total_time = deque(maxlen=metrics_window)
+
+    async def detect(self, frame, *args):
+        """Extra arguments are passed to detect_fn along with the frame"""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        waiters = [waiter]
+
+        if len(self._pending) >= self.queue_size:
+            _, _, dropped_waiters, _ = self._pending.popleft()
+            waiters = dropped_waiters + waiters
+            self.superseded += 1
+
+        self._pending.append((frame, args, waiters, time.perf_counter()))
+        self._dispatch(loop)
+        return await asyncio.shield(waiter)
+
+    def _dispatch(self, loop):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='detection')
+
+        while self._busy < self.workers and self._pending:
+            frame, args, waiters, queued_at = self._pending.popleft()
+            self._busy += 1
+            task = loop.run_in_executor(self._executor, self._run, frame, args, queued_at)
+            task.add_done_callback(lambda t, w=waiters, q=queued_at: self._on_done(loop, t, w, q))
+
+    def _run(self, frame, args, queued_at):
+        started_at = time.perf_counter()
+        result = self.detect_fn(frame, *args)
+        return result, started_at - queued_at, time.perf_counter() - started_at
+
+    def _on_done(self, loop, task, waiters, queued_at):
+        self._busy -= 1
+
+        if task.cancelled() or task.exception() is not None:
+            self.failed += 1
+            error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(error)
+        else:
+            result, queue_wait, inference_time = task.result()
+            self.completed += 1
+            self._queue_wait.append(queue_wait)
+            self._inference_time.append(inference_time)
+            self._total_time.append(time.perf_counter() - queued_at)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(result)
+
+        self._dispatch(loop)
+
+    def get_metrics(self) -> dict:
+        return {
+            'workers': self.workers,
+            'busy': self._busy,
+            'pending': len(self._pending),
+            'completed': self.completed,
+            'superseded': self.superseded,
+            'failed': self.failed,
+            'queue_wait_ms': _summary_ms(self._queue_wait),
+            'inference_ms': _summary_ms(self._inference_time),
+            'total_ms': _summary_ms(self._total_time),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _summary_ms(samples) -> dict:
+    if not samples:
+        return {'last': None, 'avg': None, 'p50': None, 'p95': None, 'max': None}
+
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        'last': samples[-1] * 1000,
+        'avg': sum(ordered) / len(ordered) * 1000,
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'max': ordered[-1] * 1000,
+    }
+
+
+detection_service = DetectionService(
+    detect_frame,
+    workers=DETECTION_WORKERS,
+    queue_size=DETECTION_QUEUE_SIZE,
+    metrics_window=DETECTION_METRICS_WINDOW,
+)
+
+
+async def detect_cars(frame, roi=None):
+    """Vehicle detections of the frame from the shared detection service, len() is the vehicle count"""
+    return await detection_service.detect(frame, roi)
@@ -0,0 +1,58 @@
+import numpy as np
+
+from core.controller import congestion_multipliers, lights
+
+# Integer codes used by the batch API, index into these lists to get the names back
+CONGESTION_LEVELS = ['low', 'medium', 'high', 'very_high']
+PHASES = ['red', 'yellow', 'green']
+
+# get_congestion: above 5 is medium, above 10 high, above 15 very high
+CONGESTION_THRESHOLDS = np.array([5, 10, 15])
+
+
+def congestion_levels(counts, thresholds=CONGESTION_THRESHOLDS) -> np.ndarray:
+    """Vectorized get_congestion, returns indexes into CONGESTION_LEVELS"""
+    return np.searchsorted(np.asarray(thresholds), np.asarray(counts), side='left')
+
+
+def phase_codes(phases) -> np.ndarray:
+    """Accepts phase names or codes, returns indexes into PHASES"""
+    phases = np.asarray(phases)
+    if phases.dtype.kind in 'iu':
+        return phases
+
+    codes = np.full(phases.shape, -1, dtype=np.int8)
+    for code, phase in enumerate(PHASES):
+        codes[phases == phase] = code
+    if (codes < 0).any():
+        raise ValueError(f"Unknown phase in {np.unique(phases[codes < 0])}")
+    return codes
+
+
+def phase_durations(counts, phases, multipliers: dict = None, base_times: dict = None,
+                    thresholds=CONGESTION_THRESHOLDS) -> np.ndarray:
+    """
+    Vectorized phase_duration for a whole fleet: counts and phases are arrays of the same shape,
+    returns the max time of each light's phase in seconds with the same thresholds and rounding.
+    multipliers, base_times and thresholds replace the controller's tables, to evaluate other timings.
+    """
+    levels = congestion_levels(counts, thresholds)
+    codes = phase_codes(phases)
+
+    # Read the tables on every call, like the scalar path, so runtime changes to them apply here too
+    multipliers = congestion_multipliers if multipliers is None else multipliers
+    base_times = lights if base_times is None else base_times
+    multipliers = np.array([multipliers.get(level, 0) for level in CONGESTION_LEVELS], dtype=np.float64)
+    base_times = np.array([base_times.get(phase, 5) for phase in PHASES])
+
+    base = base_times[codes]
+    adjustment = np.trunc(base * multipliers[levels]).astype(base.dtype)
+    return np.where(codes == PHASES.index('red'), base - adjustment, base + adjustment)
+
+
+def green_red_durations(counts) -> tuple[np.ndarray, np.ndarray]:
+    """Green and red times every light would get for its current count"""
+    counts = np.asarray(counts)
+    green = phase_durations(counts, np.full(counts.shape, PHASES.index('green')))
+    red = phase_durations(counts, np.full(counts.shape, PHASES.index('red')))
+    return green, red
@@ -0,0 +1,238 @@
+import asyncio
+import json
+from typing import Optional
+
+from aiohttp import WSMsgType, web
+
+from core.config import (
+    DECODE_THREADS, DECODE_HW_ACCELERATION, DECODE_EVERY_NTH, DECODE_KEYFRAMES_ONLY, DECODE_WIDTH, MODEL_FRAME_SIZE,
+    PROCESS_PIPELINE, FRAME_RING_SLOTS, PROCESS_INFERENCE_FPS, HISTORY_DIR, HISTORY_FLUSH_SECONDS,
+    HISTORY_RETENTION_DAYS
+)
+from core.controller import (
+    default_intersection, update_counts, get_vehicle_count, get_lane_counts, get_count_summary, get_max_time,
+    calculate_and_store_max_time, get_current_color, get_time_remaining, subscribe, unsubscribe, start_traffic_light,
+    stop_traffic_light, should_trigger_detection, clear_detection_flag, record_history
+)
+from core.detection_service import detection_service, detect_cars
+from core.metrics import scrape, cache_stats, query_history
+from core.model import model_manager
+from core.process_pipeline import ProcessGrabber
+from utils.decoder import DecodeOptions
+from utils.frame_grabber import FrameGrabber
+from utils.metrics import monitor_event_loop
+from utils.timeseries_store import TimeSeriesStore
+
+
+class HeadlessService:
+    """
+    The counting and timing loop of one video or RTSP source without the dashboard: the grabber decodes frames,
+    the controller asks for a detection when the light turns red or green, and every phase change and new count
+    is pushed to the WebSocket clients. Nothing here imports NiceGUI, frames are never encoded.
+    """
+
+    def __init__(self, source_type: str, source_path: str, roi=None, options: Optional[DecodeOptions] = None):
+        self.source_type = source_type
+        self.source_path = source_path
+        self.roi = roi
+        # Nothing is displayed: the decoded frame stands in for the display frame without a resize, only the
+        # process pipeline copies it into shared memory and gets a model-sized one instead
+        self.options = options or DecodeOptions(
+            threads=DECODE_THREADS,
+            hw_acceleration=DECODE_HW_ACCELERATION,
+            every_nth=DECODE_EVERY_NTH,
+            keyframes_only=DECODE_KEYFRAMES_ONLY,
+            decode_width=DECODE_WIDTH,
+            display_width=MODEL_FRAME_SIZE if PROCESS_PIPELINE else 0,
+            model_size=MODEL_FRAME_SIZE,
+        )
+        self.grabber = None
+        self.history = None
+        self.clients = set()
+        self.detections = 0
+        self.failed = 0
+        self._tasks = set()
+
+    def create_grabber(self):
+        if PROCESS_PIPELINE:
+            return ProcessGrabber(self.source_type, self.source_path, options=self.options, roi=self.roi,
+                                  slots=FRAME_RING_SLOTS, inference_fps=PROCESS_INFERENCE_FPS)
+        return FrameGrabber(self.source_type, self.source_path, options=self.options)
+
+    async def start(self) -> bool:
+        grabber = self.create_grabber()
+        # Opening blocks until the first frame is decoded, the event loop keeps serving meanwhile
+        if not await asyncio.get_running_loop().run_in_executor(None, grabber.start):
+            return False
+        if self.roi is not None:
+            self.roi.set_source_size(grabber.source_size)
+        self.grabber = grabber
+
+        if HISTORY_DIR:
+            self.history = TimeSeriesStore(HISTORY_DIR, HISTORY_FLUSH_SECONDS, HISTORY_RETENTION_DAYS)
+            self.history.start()
+            record_history(self.history)
+        subscribe(self.on_transition)
+        start_traffic_light()
+        # Count once right away instead of running the first phase on an empty road
+        self._spawn(self.detect_and_update())
+        return True
+
+    async def stop(self):
+        unsubscribe(self.on_transition)
+        stop_traffic_light()
+        if self.grabber is not None:
+            self.grabber.stop()
+            # The decoding thread must be out of OpenCV before the interpreter shuts down
+            await asyncio.get_running_loop().run_in_executor(None, self.grabber.join, 5)
+        if self.history is not None:
+            record_history(None)
+            self.history.close()
+
+    def _spawn(self, coroutine):
+        # The loop only keeps weak references to tasks
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def on_transition(self, event: dict):
+        if should_trigger_detection():
+            clear_detection_flag()
+            self._spawn(self.detect_and_update())
+        self.publish('phase')
+
+    async def detect_and_update(self):
+        if isinstance(self.grabber, ProcessGrabber):
+            # No frame is read here, until the inference process has a first result the count holds
+            result = self.grabber.latest_detections()
+            if result is None:
+                return
+            detections, shape, _ = result
+        else:
+            _, frame, _ = self.grabber.read_model()
+            if frame is None:
+                return
+            try:
+                detections = await detect_cars(frame, self.roi)
+            except Exception as e:
+                print(f"Error detecting cars: {e}")
+                self.failed += 1
+                return
+            shape = frame.shape
+
+        update_counts(detections, shape, self.roi)
+        calculate_and_store_max_time()
+        self.detections += 1
+        self.publish('counts')
+
+    def state(self) -> dict:
+        return {
+            'junction_id': default_intersection.junction_id,
+            'color': get_current_color(),
+            'time_remaining': get_time_remaining(),
+            'max_time': get_max_time(),
+            'count': get_vehicle_count(),
+            'lane_counts': get_lane_counts(),
+            'history': get_count_summary(),
+        }
+
+    def publish(self, kind: str):
+        if self.clients:
+            self._spawn(self._broadcast(json.dumps({'type': kind, **self.state()})))
+
+    async def _broadcast(self, message: str):
+        clients = list(self.clients)
+        results = await asyncio.gather(*(client.send_str(message) for client in clients), return_exceptions=True)
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception):
+                self.clients.discard(client)
+
+    def get_stats(self) -> dict:
+        return {
+            'source_type': self.source_type,
+            'source': self.grabber.get_stats() if self.grabber is not None else None,
+            'detections': self.detections,
+            'failed': self.failed,
+            'clients': len(self.clients),
+            'history': self.history.get_stats() if self.history is not None else None,
+        }
+
+
+def create_app(service: HeadlessService) -> web.Application:
+    """
+    JSON and WebSocket API of a headless controller:
+    GET /state, GET /ws (the state on connect, then every phase change and count), GET /history (count rollups
+    of ?series= over the last ?hours= per ?interval= seconds), GET /status and GET /metrics
+    """
+    routes = web.RouteTableDef()
+
+    @routes.get('/state')
+    async def state(request):
+        return web.json_response(service.state())
+
+    @routes.get('/ws')
+    async def websocket(request):
+        client = web.WebSocketResponse(heartbeat=30)
+        await client.prepare(request)
+        await client.send_str(json.dumps({'type': 'state', **service.state()}))
+        service.clients.add(client)
+        try:
+            # Clients only listen, incoming messages are ignored until the connection closes
+            async for message in client:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            service.clients.discard(client)
+        return client
+
+    @routes.get('/history')
+    async def history(request):
+        if service.history is None:
+            raise web.HTTPNotFound(text='History is disabled, set TRAFFIC_HISTORY_DIR')
+        try:
+            series = request.query.get('series', 'main')
+            hours = float(request.query.get('hours', 24))
+            interval = float(request.query.get('interval', 300))
+            result = await query_history(service.history, series, hours, interval)
+        except ValueError:
+            raise web.HTTPBadRequest(text='hours and interval must be positive numbers')
+        return web.json_response(result)
+
+    @routes.get('/status')
+    async def status(request):
+        return web.json_response({
+            **service.get_stats(),
+            'model': model_manager.status(),
+            'detection': detection_service.get_metrics(),
+            'cache': cache_stats(service.grabber),
+        })
+
+    @routes.get('/metrics')
+    async def metrics(request):
+        body, content_type = scrape(service.source_type, service.grabber)
+        # aiohttp wants the charset apart from the media type
+        media_type, _, charset = content_type.partition('; charset=')
+        return web.Response(body=body, content_type=media_type, charset=charset or None)
+
+    async def on_startup(app):
+        if not PROCESS_PIPELINE:
+            # With the process pipeline the inference process loads its own model, the server needs none
+            model_manager.start_background_load()
+        app['event_loop_monitor'] = asyncio.create_task(monitor_event_loop())
+        if not await service.start():
+            raise RuntimeError(f"Failed to open {service.source_type} source {service.source_path}")
+
+    async def on_shutdown(app):
+        for client in list(service.clients):
+            await client.close()
+
+    async def on_cleanup(app):
+        app['event_loop_monitor'].cancel()
+        await service.stop()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
+    return app
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from core.controller import get_current_color, get_vehicle_count, get_max_time
+from core.model import detection_cache
+from core.process_pipeline import ProcessGrabber
+from utils.metrics import (
+    LIGHT_PHASE, VEHICLE_COUNT, PHASE_MAX_SECONDS, update_source_gauges, clear_source_gauges, metrics_payload
+)
+
+
+def scrape(source_type: str, grabber) -> tuple[bytes, str]:
+    """Body and content type of a Prometheus scrape, gauges are read from the running pipeline at this point"""
+    clear_source_gauges()
+    if grabber is not None:
+        update_source_gauges(source_type, grabber.get_stats())
+    LIGHT_PHASE.state(get_current_color())
+    VEHICLE_COUNT.set(get_vehicle_count())
+    PHASE_MAX_SECONDS.set(get_max_time())
+    return metrics_payload()
+
+
+def cache_stats(grabber) -> dict:
+    """Detection cache statistics, of the inference process when the process pipeline detects"""
+    if isinstance(grabber, ProcessGrabber) and grabber.inference_stats is not None:
+        return grabber.inference_stats['cache']
+    return detection_cache.get_stats()
+
+
+async def query_history(store, series: str, hours: float, interval: float) -> dict:
+    """Count rollups of one series over the last hours, ValueError unless hours and interval are positive"""
+    if not (hours > 0 and interval > 0):
+        raise ValueError("hours and interval must be positive")
+    end = time.time()
+    # Rolling up a long range reads many days of records, the event loop keeps serving meanwhile
+    return await asyncio.get_running_loop().run_in_executor(
+        None, store.query, series, end - hours * 3600, end, interval)
@@ -1,36 +1,251 @@
-import supervision as sv
+import threading
+import time
+from pathlib import Path
+
 import numpy as np
 from numpy import ndarray
-from ultralytics import YOLO
 
-model = YOLO("../models/yolov8n.pt")
+from core.backends import create_backend, empty_detections
+from core.config import (
+    MODEL_PATH, MODEL_WARMUP, INFERENCE_BACKEND, INFERENCE_INT8, INFERENCE_IMAGE_SIZE, DETECTION_CONFIDENCE,
+    DETECTION_IOU, DETECTION_CACHE_SIZE, DETECTION_CACHE_MAX_AGE, DETECTION_CACHE_STRIDE
+)
+from core.detection_cache import DetectionCache
+from utils.metrics import INFERENCE_SECONDS
 
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+MODEL_NAME = 'yolov8n.pt'
 
-def count_cars_from_frame(frame: np.ndarray) -> tuple[int, None] | tuple[int, ndarray]:
+
+def resolve_model_path() -> str:
+    """Configured path first, then models/ inside or next to the project, whatever the working directory is"""
+    if MODEL_PATH:
+        return MODEL_PATH
+
+    for candidate in (PROJECT_ROOT / 'models' / MODEL_NAME, PROJECT_ROOT.parent / 'models' / MODEL_NAME):
+        if candidate.exists():
+            return str(candidate)
+
+    # ultralytics downloads the official weights when given the bare name
+    return MODEL_NAME
+
+
+class ModelManager:
+    """
+    Loads the inference backend lazily, or in a background thread at startup, so importing this module
+    is cheap and the dashboard is served while the runtime and the weights load. Callers asking for the
+    model before it's ready wait for the load instead of starting a second one.
+    """
+
+    def __init__(self, model_path: str = None, warmup: bool = True, backend: str = 'torch', int8: bool = False):
+        self.model_path = model_path
+        self.warmup = warmup
+        self.backend = backend
+        self.int8 = int8
+        self.state = 'idle'
+        self.error = None
+        self.load_time = None
+        self.warmup_time = None
+
+        self._model = None
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        # ultralytics predictors keep per-call state, so every thread running inference gets its own backend.
+        # The first thread reuses the already loaded one, others load their own copy.
+        self._thread_models = threading.local()
+        self._owner = None
+
+    def start_background_load(self):
+        if self.state == 'idle':
+            threading.Thread(target=self.load, name='model-loader', daemon=True).start()
+
+    def load(self):
+        with self._load_lock:
+            if self.state in ('ready', 'failed'):
+                return
+            self.state = 'loading'
+            try:
+                self.model_path = self.model_path or resolve_model_path()
+                started_at = time.perf_counter()
+                self._model = self._create_model()
+                self.load_time = time.perf_counter() - started_at
+                print(f"Loaded {self.model_path} ({self.backend}) in {self.load_time:.2f}s")
+                self.state = 'ready'
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                self.error = str(e)
+                self.state = 'failed'
+            finally:
+                self._ready.set()
+
+    def _create_model(self):
+        backend = create_backend(self.backend, self.model_path, self.int8)
+        if self.warmup:
+            started_at = time.perf_counter()
+            backend.detect([np.zeros((INFERENCE_IMAGE_SIZE, INFERENCE_IMAGE_SIZE, 3), dtype=np.uint8)])
+            self.warmup_time = time.perf_counter() - started_at
+        return backend
+
+    def is_ready(self) -> bool:
+        return self.state == 'ready'
+
+    def get_model(self):
+        thread_model = getattr(self._thread_models, 'model', None)
+        if thread_model is not None:
+            return thread_model
+
+        if not self._ready.is_set():
+            self.load()
+        if self.state != 'ready':
+            raise RuntimeError(f"Model is not available: {self.error}")
+
+        with self._load_lock:
+            if self._owner is None:
+                self._owner = threading.get_ident()
+                thread_model = self._model
+        if thread_model is None:
+            thread_model = self._create_model()
+        self._thread_models.model = thread_model
+        return thread_model
+
+    def version(self) -> tuple:
+        """Identifies what a detection result depends on, cached results of another version are never reused"""
+        return self.backend, self.model_path, self.int8, INFERENCE_IMAGE_SIZE, DETECTION_CONFIDENCE, DETECTION_IOU
+
+    def status(self) -> dict:
+        return {
+            'state': self.state,
+            'backend': self.backend,
+            'int8': self.int8,
+            'model_path': self.model_path,
+            'load_time': self.load_time,
+            'warmup_time': self.warmup_time,
+            'error': self.error,
+        }
+
+
+model_manager = ModelManager(MODEL_PATH, warmup=MODEL_WARMUP, backend=INFERENCE_BACKEND, int8=INFERENCE_INT8)
+
+
+def get_model():
+    return model_manager.get_model()
+
+
+# Results of repeated frames (same image loaded again, frozen camera) cost a hash instead of an inference
+detection_cache = DetectionCache(DETECTION_CACHE_SIZE, DETECTION_CACHE_MAX_AGE, DETECTION_CACHE_STRIDE)
+
+
+# COCO class ids for car, bus and truck
+VEHICLE_CLASS_IDS = [2, 5, 7]
+
+
+def vehicle_detections(detections):
+    return detections[np.isin(detections.class_id, VEHICLE_CLASS_IDS)]
+
+
+def detect_vehicles(frames: list[np.ndarray]) -> list:
+    """Vehicle detections (supervision Detections) of each frame, from one batched inference"""
+    if not frames:
+        return []
+
+    model = get_model()
+    with INFERENCE_SECONDS.labels(model_manager.backend).time():
+        results = model.detect(frames)
+    return [vehicle_detections(detections) for detections in results]
+
+
+def count_cars_from_frames(frames: list[np.ndarray]) -> list[int]:
+    """Run one batched inference over several frames and return the vehicle count of each"""
+    return [len(detections) for detections in detect_vehicles(frames)]
+
+
+def detect_frame(frame: np.ndarray, roi=None):
+    """
+    Vehicle detections of one frame, pure inference: no copy, no drawing.
+    With a RegionOfInterest only the area around its lanes is sent to the model,
+    and only vehicles inside a lane are returned, boxes are in frame coordinates.
+    Frames seen recently are answered from the detection cache, the result must not be modified.
+    """
     if frame is None:
-        return 0, None
+        return empty_detections()
+
+    return detection_cache.get_or_compute(
+        frame, lambda: _detect_frame(frame, roi),
+        model_manager.version(), roi.cache_key() if roi is not None else None,
+    )
+
+
+def _detect_frame(frame: np.ndarray, roi=None):
+    if roi is None:
+        return detect_vehicles([frame])[0]
+
+    crop, (x0, y0) = roi.crop(frame)
+    if crop.size == 0:
+        return empty_detections()
+
+    detections = detect_vehicles([crop])[0]
+    if len(detections):
+        detections.xyxy = detections.xyxy + np.array([x0, y0, x0, y0], dtype=detections.xyxy.dtype)
+    return roi.inside(detections, frame.shape)
 
-    try:
-        res = model(frame, verbose=False)
-        detections = sv.Detections.from_ultralytics(res[0])
-        detections = detections[(detections.class_id == 2) | (detections.class_id == 5) | (detections.class_id == 7)]
 
-        car_count = len(detections.class_id)
+def count_vehicles(frame: np.ndarray, roi=None) -> int:
+    return len(detect_frame(frame, roi))
 
-        annotated = frame.copy()
-        labels = [
-            f"{class_id} {class_name}"
-            for class_id, class_name
-            in zip(detections['class_name'], detections.class_id)
-        ]
 
-        box_annotator = sv.BoxAnnotator()
-        label_annotator = sv.LabelAnnotator()
+def scale_detections(detections, scale: float):
+    """Detections of a model-sized frame in the coordinates of a frame `scale` times larger"""
+    if scale == 1.0 or len(detections) == 0:
+        return detections
+    scaled = detections[np.arange(len(detections))]
+    scaled.xyxy = detections.xyxy * scale
+    return scaled
 
-        annotated = box_annotator.annotate(annotated, detections)
-        annotated = label_annotator.annotate(annotated, detections, labels)
 
-        return car_count, annotated
+# Annotators hold no per-frame state, build them once instead of on every frame
+_annotators = {}
+_annotators_lock = threading.Lock()
+
+
+def get_annotators() -> dict:
+    # Annotation runs in several worker threads, none may see the box annotator without the label one
+    if not _annotators:
+        with _annotators_lock:
+            if not _annotators:
+                import supervision as sv
+
+                _annotators.update(box=sv.BoxAnnotator(), label=sv.LabelAnnotator())
+    return _annotators
+
+
+def annotate_frame(frame: np.ndarray, detections) -> ndarray:
+    """Copy of the frame with the boxes and labels of the detections drawn on it"""
+    if len(detections) == 0:
+        return frame.copy()
+    annotators = get_annotators()
+
+    # Detections rebuilt from boxes alone (process pipeline, other backends) may carry no class names
+    class_names = detections.data.get('class_name', detections.class_id)
+    labels = [
+        f"{class_id} {class_name}"
+        for class_id, class_name
+        in zip(class_names, detections.class_id)
+    ]
+    if detections.tracker_id is not None:
+        labels = [f"#{tracker_id} {label}" for tracker_id, label in zip(detections.tracker_id, labels)]
+
+    annotated = annotators['box'].annotate(frame.copy(), detections)
+    return annotators['label'].annotate(annotated, detections, labels)
+
+
+def count_cars_from_frame(frame: np.ndarray) -> tuple[int, None] | tuple[int, ndarray]:
+    """Count and annotated frame in one call, for callers that always display the result"""
+    if frame is None:
+        return 0, None
+
+    try:
+        detections = detect_frame(frame)
+        return len(detections), annotate_frame(frame, detections)
     except Exception as e:
         print(f"Error detecting cars: {e}")
         return 0, frame
@@ -0,0 +1,315 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from utils.decoder import DecodeOptions, split_frame
+from utils.frame_grabber import FrameGrabber
+from utils.metrics import INFERENCE_SECONDS
+from utils.shm_ring import FrameRing
+
+# Child processes are spawned, never forked: the server process runs threads and may hold an initialized torch
+_context = multiprocessing.get_context('spawn')
+
+
+class RingGrabber(FrameGrabber):
+    """FrameGrabber of the capture process, publishes into shared memory rings instead of keeping the frame"""
+
+    def __init__(self, source_type: str, source_path: str, options: DecodeOptions, slots: int, conn):
+        super().__init__(source_type, source_path, options=options)
+        self.slots = slots
+        self.conn = conn
+        self.display_ring = None
+        self.model_ring = None
+
+    def _publish(self, frame):
+        display, model, scale = split_frame(frame, self.options.display_width, self.options.model_size)
+        first = self.display_ring is None
+        if first:
+            # Rings get the shape of the first frame
+            self.display_ring = FrameRing(None, display.shape, self.slots, create=True)
+            self.model_ring = FrameRing(None, model.shape, self.slots, create=True)
+
+        # A reconnected stream may come back at another resolution, the rings keep theirs
+        if display.shape != self.display_ring.shape:
+            display = cv2.resize(display, self.display_ring.shape[1::-1], interpolation=cv2.INTER_AREA)
+        if model.shape != self.model_ring.shape:
+            model = cv2.resize(model, self.model_ring.shape[1::-1], interpolation=cv2.INTER_AREA)
+
+        now = time.time()
+        self.model_ring.write(model, now)
+        self.display_ring.write(display, now)
+        self.grabbed += 1
+
+        if first:
+            # The server attaches once it's told their names, both rings already hold a frame by then
+            self.conn.send(('ready', {
+                'display': self.display_ring.spec(),
+                'model': self.model_ring.spec(),
+                'scale': scale,
+                'source_size': self.source_size,
+            }))
+
+
+def capture_main(source_type: str, source_path: str, options: DecodeOptions, slots: int, conn, stop_event):
+    """Capture process: decode the source and write display and model frames into shared memory"""
+    grabber = RingGrabber(source_type, source_path, options, slots, conn)
+    if not grabber.start():
+        conn.send(('failed', None))
+        return
+    try:
+        while grabber.running and not stop_event.wait(0.2):
+            pass
+    finally:
+        grabber.stop()
+        grabber.join(5)
+        for ring in (grabber.display_ring, grabber.model_ring):
+            if ring is not None:
+                ring.close()
+
+
+def inference_main(model_spec: tuple, roi, fps: float, results, stop_event):
+    """Inference process: detect vehicles on the newest model frame, at most fps times per second, and send the
+    boxes of each over the results pipe. Metrics of this process are sent along, the server exports them."""
+    from core.model import detect_frame, detection_cache, model_manager
+
+    ring = FrameRing(*model_spec)
+    model_manager.load()
+    interval = 1 / fps
+    last_seq = 0
+    # Durations of the model calls since the last result sent, a cache hit calls no model
+    inference_seconds = []
+    try:
+        while not stop_event.is_set():
+            latest = ring.read(last_seq)
+            if latest is None:
+                time.sleep(0.005)
+                continue
+            started_at = time.monotonic()
+            seq, timestamp, frame = latest
+            misses = detection_cache.misses
+            detections = detect_frame(frame, roi)
+            if detection_cache.misses != misses or not detection_cache.enabled:
+                inference_seconds.append(time.monotonic() - started_at)
+            if not ring.valid(seq):
+                # The capture process reused the slot during inference, the boxes may belong to a torn frame
+                continue
+            last_seq = seq
+            stats = {'backend': model_manager.backend, 'inference_seconds': inference_seconds,
+                     'cache': detection_cache.get_stats()}
+            results.send((seq, timestamp, time.time(), detections.xyxy, detections.class_id, detections.confidence,
+                          detections.data.get('class_name'), stats))
+            inference_seconds = []
+
+            delay = interval - (time.monotonic() - started_at)
+            if delay > 0:
+                stop_event.wait(delay)
+    except Exception as e:
+        print(f"Error in inference process: {e}")
+    finally:
+        ring.close()
+        results.close()
+
+
+class ProcessGrabber:
+    """
+    Same interface as FrameGrabber, but decoding runs in a capture process and detection in an inference process,
+    so neither competes with the server for the GIL. Frames reach this process through shared memory rings
+    (FrameRing), read() and read_model() return read-only views of them, nothing is copied. The capture process
+    reuses a slot after `slots` frames, a caller holding on to a frame takes a copy with keep().
+    Detections come back over a pipe, only boxes and classes are pickled, a thread keeps the newest result.
+    Stops both processes with stop().
+    """
+
+    def __init__(self, source_type: str, source_path: str, options: Optional[DecodeOptions] = None, roi=None,
+                 slots: int = 8, inference_fps: float = 10, start_timeout: float = 15.0):
+        self.source_type = source_type
+        self.source_path = source_path
+        self.options = options or DecodeOptions()
+        self.roi = roi
+        self.slots = slots
+        self.inference_fps = inference_fps
+        self.start_timeout = start_timeout
+        self.source_size = None
+        self.model_scale = 1.0
+        self.model_shape = None
+
+        self._stop_event = _context.Event()
+        self._results_thread = None
+        self._capture = None
+        self._inference = None
+        self._display_ring = None
+        self._model_ring = None
+        # join() unmaps the rings, a read copying from them meanwhile would touch freed memory
+        self._rings_lock = threading.Lock()
+        self._last = (0, None, None)
+        self._latest_result = None
+        # Backend and detection cache statistics of the inference process, with its newest result
+        self.inference_stats = None
+        self._latest_detections = None
+
+        self.dropped = 0
+        self._read_times = deque(maxlen=60)
+
+    def start(self) -> bool:
+        parent_conn, child_conn = _context.Pipe(duplex=False)
+        self._capture = _context.Process(
+            target=capture_main, name=f'capture-{self.source_type}', daemon=True,
+            args=(self.source_type, self.source_path, self.options, self.slots, child_conn, self._stop_event))
+        self._capture.start()
+
+        # Blocks like opening a capture does, until the first frame is decoded
+        if not parent_conn.poll(self.start_timeout):
+            self.stop()
+            return False
+        status, info = parent_conn.recv()
+        if status != 'ready':
+            self.stop()
+            return False
+
+        self._display_ring = FrameRing(*info['display'])
+        self._model_ring = FrameRing(*info['model'])
+        self.model_scale = info['scale']
+        self.model_shape = self._model_ring.shape
+        self.source_size = info['source_size']
+
+        if self.roi is not None:
+            self.roi.set_source_size(self.source_size)
+        results, child_results = _context.Pipe(duplex=False)
+        self._inference = _context.Process(
+            target=inference_main, name='inference', daemon=True,
+            args=(info['model'], self.roi, self.inference_fps, child_results, self._stop_event))
+        self._inference.start()
+        # Only the inference process may hold the sending end, its exit then ends the receiving thread
+        child_results.close()
+        self._results_thread = threading.Thread(
+            target=self._receive_results, args=(results,), name='inference-results', daemon=True)
+        self._results_thread.start()
+        return True
+
+    def _receive_results(self, results):
+        """Read every result as it arrives, so the newest is kept however rarely latest_detections() is called"""
+        try:
+            while True:
+                result = results.recv()
+                stats = result[-1]
+                # The inference process's own registry is never scraped, its model calls are counted here
+                for seconds in stats.pop('inference_seconds'):
+                    INFERENCE_SECONDS.labels(stats['backend']).observe(seconds)
+                self.inference_stats = stats
+                self._latest_result = result
+        except (EOFError, OSError):
+            pass
+        finally:
+            results.close()
+
+    def stop(self):
+        """Signal both processes to exit, waiting for them and unmapping the rings happens in a thread"""
+        if not self._stop_event.is_set():
+            self._stop_event.set()
+            threading.Thread(target=self.join, args=(5,), name='process-grabber-stop', daemon=True).start()
+
+    def join(self, timeout: Optional[float] = None):
+        for process in (self._capture, self._inference):
+            if process is not None:
+                process.join(timeout)
+        if self._results_thread is not None and self._results_thread is not threading.current_thread():
+            self._results_thread.join(timeout)
+        with self._rings_lock:
+            rings = (self._display_ring, self._model_ring)
+            self._display_ring = self._model_ring = None
+            for ring in rings:
+                if ring is not None:
+                    ring.close()
+
+    @property
+    def running(self) -> bool:
+        return (not self._stop_event.is_set() and self._capture is not None and self._capture.is_alive()
+                and self._display_ring is not None)
+
+    def read(self) -> tuple[int, Optional[float], Optional[np.ndarray]]:
+        """(sequence number, capture timestamp, display frame view) of the newest frame"""
+        with self._rings_lock:
+            ring = self._display_ring
+            latest = ring.read(self._last[0]) if ring is not None else None
+        if latest is not None:
+            seq = latest[0]
+            if self._last[0] and seq > self._last[0] + 1:
+                self.dropped += seq - self._last[0] - 1
+            self._last = latest
+            self._read_times.append(time.monotonic())
+        return self._last
+
+    def read_model(self) -> tuple[int, Optional[np.ndarray], float]:
+        with self._rings_lock:
+            ring = self._model_ring
+            latest = ring.read(0) if ring is not None else None
+        if latest is None:
+            return 0, None, self.model_scale
+        seq, _, frame = latest
+        return seq, frame, self.model_scale
+
+    def valid(self, seq: int) -> bool:
+        """Whether the display and model frames of seq are still in their slots"""
+        with self._rings_lock:
+            rings = (self._display_ring, self._model_ring)
+            return all(ring is not None and ring.valid(seq) for ring in rings)
+
+    def keep(self, seq: int, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Copy of a frame view of seq to hold on to, None when its slot was reused before the copy was complete"""
+        frame = frame.copy()
+        return frame if self.valid(seq) else None
+
+    async def next_frame(self, last_seq: int, timeout: float = 1.0):
+        """Wait until a frame newer than last_seq is available, returns None on timeout"""
+        deadline = time.monotonic() + timeout
+        while self.running and time.monotonic() < deadline:
+            seq, timestamp, frame = self.read()
+            if seq > last_seq and frame is not None:
+                return seq, timestamp, frame
+            # The capture process can't wake this loop, new frames are polled for
+            await asyncio.sleep(0.005)
+        return None
+
+    def latest_detections(self):
+        """
+        (detections in model frame coordinates, model frame shape, scale to the display frame) of the newest result,
+        None before the first
+        """
+        import supervision as sv
+
+        result = self._latest_result
+        if result is None:
+            return None
+        if self._latest_detections is None or self._latest_detections[0] is not result:
+            _, _, _, xyxy, class_id, confidence, class_name, _ = result
+            data = {'class_name': class_name} if class_name is not None else {}
+            detections = sv.Detections(xyxy=xyxy, class_id=class_id, confidence=confidence, data=data)
+            self._latest_detections = (result, detections)
+        return self._latest_detections[1], self.model_shape, self.model_scale
+
+    def get_stats(self) -> dict:
+        read_times = list(self._read_times)
+        read_fps = 0.0
+        if len(read_times) > 1 and read_times[-1] > read_times[0]:
+            read_fps = (len(read_times) - 1) / (read_times[-1] - read_times[0])
+        seq, timestamp, _ = self._last
+        with self._rings_lock:
+            if self._display_ring is not None:
+                seq = self._display_ring.latest_seq
+        return {
+            'running': self.running,
+            # Frames this process took from the ring, the capture process may write more
+            'grab_fps': read_fps,
+            'grabbed': seq,
+            'dropped': self.dropped,
+            'frame_age': time.time() - timestamp if timestamp is not None else None,
+            'capture_alive': self._capture is not None and self._capture.is_alive(),
+            'inference_alive': self._inference is not None and self._inference.is_alive(),
+            'inference': self.inference_stats,
+        }
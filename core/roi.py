@@ -0,0 +1,136 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class LaneRegion:
+
+    def __init__(self, name: str, polygon):
+        self.name = name
+        self.polygon = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError(f"Lane '{name}' needs at least 3 points")
+
+
+class RegionOfInterest:
+    """
+    Approach lanes of one source as polygons in source pixel coordinates.
+    Only the bounding box of all lanes is sent to the model, and only vehicles standing
+    (bottom center of the box) inside a lane are counted, per lane.
+    Optional counting lines (e.g. stop lines) are used by the tracker for crossing counts.
+    A region with counting lines but no lanes covers the whole frame and counts every vehicle.
+    """
+
+    def __init__(self, lanes: list[LaneRegion], source_size: Optional[tuple[int, int]] = None, padding: int = 16,
+                 lines: Optional[dict[str, np.ndarray]] = None):
+        if not lanes and not lines:
+            raise ValueError("A region of interest needs at least one lane or counting line")
+        self.lanes = lanes
+        self.lines = lines or {}
+        # (width, height) the polygons were drawn on, frames of another size get scaled polygons
+        self.source_size = source_size
+        self.padding = padding
+        self._scaled = {}
+
+    @classmethod
+    def parse(cls, text: str, source_size: Optional[tuple[int, int]] = None) -> Optional['RegionOfInterest']:
+        """
+        One lane per line: 'name: x1,y1 x2,y2 x3,y3 ...', empty text means no region.
+        A line with only two points is a counting line instead of a lane.
+        """
+        lanes = []
+        lines = {}
+        for number, line in enumerate(text.strip().splitlines(), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            name, separator, points = line.partition(':')
+            if not separator:
+                name, points = f'lane {number}', line
+            try:
+                polygon = [[float(value) for value in point.split(',')] for point in points.split()]
+            except ValueError:
+                raise ValueError(f"Line {number}: points must look like x,y") from None
+            if any(len(point) != 2 for point in polygon):
+                raise ValueError(f"Line {number}: points must look like x,y")
+            if len(polygon) == 2:
+                lines[name.strip()] = np.asarray(polygon, dtype=np.float32)
+            else:
+                lanes.append(LaneRegion(name.strip(), polygon))
+
+        if not lanes and not lines:
+            return None
+        return cls(lanes, source_size, lines=lines)
+
+    def cache_key(self) -> tuple:
+        """Everything the detections of a frame depend on, for the detection cache"""
+        return (
+            tuple((lane.name, lane.polygon.tobytes()) for lane in self.lanes),
+            self.source_size,
+            self.padding,
+        )
+
+    def set_source_size(self, source_size: Optional[tuple[int, int]]):
+        """Size of the frames the polygons were drawn on, e.g. once the source is opened"""
+        self.source_size = source_size
+        self._scaled = {}
+
+    def _scale(self, shape) -> np.ndarray:
+        height, width = shape[:2]
+        if self.source_size is None:
+            return np.ones(2, dtype=np.float32)
+        return np.array([width / self.source_size[0], height / self.source_size[1]], dtype=np.float32)
+
+    def polygons_for(self, shape) -> list[np.ndarray]:
+        height, width = shape[:2]
+        polygons = self._scaled.get((width, height))
+        if polygons is None:
+            polygons = [lane.polygon * self._scale(shape) for lane in self.lanes]
+            self._scaled[(width, height)] = polygons
+        return polygons
+
+    def lines_for(self, shape) -> dict[str, np.ndarray]:
+        """Counting lines as (start, end) points scaled to the frame"""
+        scale = self._scale(shape)
+        return {name: line * scale for name, line in self.lines.items()}
+
+    def bounds(self, shape) -> tuple[int, int, int, int]:
+        """x0, y0, x1, y1 of the area covering every lane, clipped to the frame"""
+        height, width = shape[:2]
+        if not self.lanes:
+            return 0, 0, width, height
+        points = np.concatenate(self.polygons_for(shape))
+        x0, y0 = np.floor(points.min(axis=0)).astype(int) - self.padding
+        x1, y1 = np.ceil(points.max(axis=0)).astype(int) + self.padding
+        return max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+
+    def crop(self, frame: np.ndarray) -> tuple[np.ndarray, tuple[int, int]]:
+        """View of the frame covering the lanes (no copy) and its offset in the frame"""
+        x0, y0, x1, y1 = self.bounds(frame.shape)
+        return frame[y0:y1, x0:x1], (x0, y0)
+
+    def lane_masks(self, detections, shape) -> dict[str, np.ndarray]:
+        if len(detections) == 0:
+            return {lane.name: np.zeros(0, dtype=bool) for lane in self.lanes}
+
+        # Vehicles are in the lane their wheels are in
+        anchors = np.column_stack([
+            (detections.xyxy[:, 0] + detections.xyxy[:, 2]) / 2,
+            detections.xyxy[:, 3],
+        ]).astype(np.float32)
+
+        return {
+            lane.name: np.array([cv2.pointPolygonTest(polygon, (float(x), float(y)), False) >= 0 for x, y in anchors])
+            for lane, polygon in zip(self.lanes, self.polygons_for(shape))
+        }
+
+    def lane_counts(self, detections, shape) -> dict[str, int]:
+        return {name: int(mask.sum()) for name, mask in self.lane_masks(detections, shape).items()}
+
+    def inside(self, detections, shape):
+        """Only the detections standing in at least one lane, all of them without lanes"""
+        if len(detections) == 0 or not self.lanes:
+            return detections
+        masks = list(self.lane_masks(detections, shape).values())
+        return detections[np.logical_or.reduce(masks)]
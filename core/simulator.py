@@ -0,0 +1,129 @@
+import time
+from typing import Optional
+
+import numpy as np
+
+from core.fleet import PHASES, phase_durations
+
+RED, YELLOW, GREEN = (PHASES.index(phase) for phase in ('red', 'yellow', 'green'))
+
+
+class TrafficSimulator:
+    """
+    Queues at thousands of intersections at once on a virtual clock, timed with the controller's rules.
+    Every intersection cycles its phase groups like IntersectionController: the active group goes green then yellow,
+    then the next group gets green, a single group also runs a red phase. Each group is one approach with a queue.
+    Vehicles arrive as a Poisson process at each approach's rate and leave a green approach at saturation_flow.
+    When a light turns red or green its queue is counted (at most max_visible vehicles, what the camera sees)
+    and the phase gets phase_duration of that count, from the controller's tables unless a policy replaces them.
+    All intersections advance together one step of dt seconds per NumPy operation, nothing runs per vehicle.
+    """
+
+    def __init__(self, arrival_rates, saturation_flow: float = 0.5, dt: float = 1.0,
+                 max_visible: Optional[int] = None, policy: Optional[dict] = None, seed: Optional[int] = None):
+        # (intersections, groups) vehicles per second, a 1D array means one approach per intersection
+        arrival_rates = np.asarray(arrival_rates, dtype=np.float64)
+        self.arrival_rates = arrival_rates[:, None] if arrival_rates.ndim == 1 else arrival_rates
+        self.saturation_flow = saturation_flow
+        self.dt = dt
+        self.max_visible = max_visible
+        # multipliers, base_times and thresholds as phase_durations takes them, missing ones are the controller's
+        self.policy = dict(policy or {})
+        self.rng = np.random.default_rng(seed)
+
+        intersections, groups = self.arrival_rates.shape
+        self.intersections = intersections
+        self.groups = groups
+        self._rows = np.arange(intersections)
+
+        self.time = 0.0
+        self.queue = np.zeros((intersections, groups), dtype=np.int64)
+        self.counts = np.zeros((intersections, groups), dtype=np.int64)
+        self._credit = np.zeros((intersections, groups))
+        self.active = np.zeros(intersections, dtype=np.int64)
+        self.color = np.full(intersections, RED, dtype=np.int64)
+        # Like the controller, every junction starts red with the red time of an empty road
+        self.phase_end = self._durations(self.counts[:, 0], self.color).astype(np.float64)
+
+        self.arrived = np.zeros((intersections, groups), dtype=np.int64)
+        self.departed = np.zeros((intersections, groups), dtype=np.int64)
+        self.wait_seconds = np.zeros((intersections, groups))
+        self.max_queue = np.zeros((intersections, groups), dtype=np.int64)
+        self.phase_changes = 0
+        self.wall_time = 0.0
+
+    def _durations(self, counts, colors) -> np.ndarray:
+        return phase_durations(counts, colors, **self.policy)
+
+    def step(self):
+        arrivals = self.rng.poisson(self.arrival_rates * self.dt)
+        self.queue += arrivals
+        self.arrived += arrivals
+
+        green = np.zeros_like(self.queue, dtype=bool)
+        green[self._rows, self.active] = self.color == GREEN
+        # Discharge capacity builds up while green, fractions carry over to the next step
+        self._credit = np.where(green, self._credit + self.saturation_flow * self.dt, 0.0)
+        departures = np.minimum(self.queue, self._credit.astype(np.int64))
+        self.queue -= departures
+        self.departed += departures
+        self._credit -= departures
+        # An empty approach can't bank capacity for vehicles that arrive later
+        self._credit[self.queue == 0] = 0.0
+
+        self.wait_seconds += self.queue * self.dt
+        np.maximum(self.max_queue, self.queue, out=self.max_queue)
+        self.time += self.dt
+        self._advance_phases()
+
+    def _advance_phases(self):
+        due = np.flatnonzero(self.phase_end <= self.time + 1e-9)
+        if due.size == 0:
+            return
+
+        color = self.color[due]
+        active = self.active[due]
+        next_color = np.select([color == GREEN, color == YELLOW], [YELLOW, RED if self.groups == 1 else GREEN], GREEN)
+        if self.groups > 1:
+            active = np.where(color == YELLOW, (active + 1) % self.groups, active)
+
+        # Red and green ask for a detection, the new count decides the phase's time
+        counted = next_color != YELLOW
+        queue = self.queue[due, active]
+        visible = queue if self.max_visible is None else np.minimum(queue, self.max_visible)
+        self.counts[due[counted], active[counted]] = visible[counted]
+
+        self.color[due] = next_color
+        self.active[due] = active
+        self.phase_end[due] = self.time + self._durations(self.counts[due, active], next_color)
+        self.phase_changes += due.size
+
+    def run(self, seconds: float) -> dict:
+        started_at = time.perf_counter()
+        for _ in range(int(round(seconds / self.dt))):
+            self.step()
+        self.wall_time += time.perf_counter() - started_at
+        return self.summary()
+
+    def summary(self) -> dict:
+        """Delay, queue length and throughput over the simulated time, across every approach"""
+        hours = self.time / 3600
+        arrived = int(self.arrived.sum())
+        per_intersection_max = self.max_queue.max(axis=1)
+        return {
+            'intersections': self.intersections,
+            'groups': self.groups,
+            'simulated_seconds': self.time,
+            'wall_seconds': self.wall_time,
+            # Simulated intersection-seconds per second of wall time
+            'speedup': self.intersections * self.time / self.wall_time if self.wall_time else None,
+            'arrived': arrived,
+            'departed': int(self.departed.sum()),
+            'avg_delay_seconds': float(self.wait_seconds.sum() / arrived) if arrived else 0.0,
+            'avg_queue': float(self.wait_seconds.sum() / self.time / self.queue.size) if self.time else 0.0,
+            'max_queue': int(per_intersection_max.max()),
+            'p95_max_queue': float(np.percentile(per_intersection_max, 95)),
+            'throughput_per_hour': float(self.departed.sum() / hours / self.intersections) if hours else 0.0,
+            'residual_queue': int(self.queue.sum()),
+            'phase_changes': self.phase_changes,
+        }
@@ -0,0 +1,131 @@
+import math
+import time
+from typing import Optional
+
+import numpy as np
+
+# Statistics the phase timing can be based on, see RollingStats.value
+STATISTICS = ('last', 'mean', 'ewma', 'median', 'p90', 'max')
+
+
+class RollingStats:
+    """
+    Recent samples of one series (e.g. the vehicle count of an approach) in a fixed size ring buffer.
+    Adding a sample is O(1): the running sum and the EWMA are updated in place, nothing is reallocated.
+    Window queries (mean, percentiles, trend) only look at the samples of the last `window` seconds,
+    without a window they cover the whole buffer and the mean stays O(1).
+    """
+
+    __slots__ = ('capacity', 'window', 'half_life', 'last', 'ewma',
+                 '_values', '_times', '_next', '_size', '_sum', '_ewma_time')
+
+    def __init__(self, capacity: int = 256, window: Optional[float] = None, half_life: float = 30.0):
+        self.capacity = max(1, capacity)
+        self.window = window
+        # Seconds after which a sample's weight in the EWMA has halved, samples may arrive at any interval
+        self.half_life = half_life
+        self.last = None
+        self.ewma = None
+
+        self._values = np.zeros(self.capacity, dtype=np.float64)
+        self._times = np.zeros(self.capacity, dtype=np.float64)
+        self._next = 0
+        self._size = 0
+        self._sum = 0.0
+        self._ewma_time = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: float, timestamp: Optional[float] = None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        index = self._next
+        if self._size == self.capacity:
+            self._sum -= self._values[index]
+        else:
+            self._size += 1
+        self._values[index] = value
+        self._times[index] = timestamp
+        self._sum += value
+        self._next = (index + 1) % self.capacity
+        self.last = value
+
+        if self.ewma is None or self.half_life <= 0:
+            self.ewma = float(value)
+        else:
+            elapsed = max(0.0, timestamp - self._ewma_time)
+            alpha = 1 - math.exp(-elapsed * math.log(2) / self.half_life)
+            self.ewma += alpha * (value - self.ewma)
+        self._ewma_time = timestamp
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
+        self._sum = 0.0
+        self.last = None
+        self.ewma = None
+        self._ewma_time = None
+
+    def _samples(self, window: Optional[float], now: Optional[float]) -> tuple[np.ndarray, np.ndarray]:
+        """(times, values) in chronological order, limited to the window when there is one"""
+        order = (self._next - self._size + np.arange(self._size)) % self.capacity
+        times, values = self._times[order], self._values[order]
+        window = self.window if window is None else window
+        if window is not None:
+            now = time.monotonic() if now is None else now
+            recent = times >= now - window
+            times, values = times[recent], values[recent]
+        return times, values
+
+    def mean(self, window: Optional[float] = None, now: Optional[float] = None) -> Optional[float]:
+        if window is None and self.window is None:
+            return self._sum / self._size if self._size else None
+        _, values = self._samples(window, now)
+        return float(values.mean()) if len(values) else None
+
+    def percentile(self, q: float, window: Optional[float] = None, now: Optional[float] = None) -> Optional[float]:
+        _, values = self._samples(window, now)
+        return float(np.percentile(values, q)) if len(values) else None
+
+    def maximum(self, window: Optional[float] = None, now: Optional[float] = None) -> Optional[float]:
+        _, values = self._samples(window, now)
+        return float(values.max()) if len(values) else None
+
+    def trend(self, window: Optional[float] = None, now: Optional[float] = None) -> float:
+        """Least squares slope in units per minute, positive while the series is growing"""
+        times, values = self._samples(window, now)
+        if len(times) < 2:
+            return 0.0
+        times = times - times.mean()
+        variance = float((times * times).sum())
+        if variance == 0:
+            return 0.0
+        return float((times * (values - values.mean())).sum()) / variance * 60
+
+    def value(self, statistic: str, now: Optional[float] = None) -> Optional[float]:
+        """One of STATISTICS over the configured window, None before the first sample"""
+        if statistic == 'last':
+            return self.last
+        if statistic == 'ewma':
+            return self.ewma
+        if statistic == 'mean':
+            return self.mean(now=now)
+        if statistic == 'median':
+            return self.percentile(50, now=now)
+        if statistic == 'p90':
+            return self.percentile(90, now=now)
+        if statistic == 'max':
+            return self.maximum(now=now)
+        raise ValueError(f"Unknown statistic: {statistic}")
+
+    def summary(self, now: Optional[float] = None) -> dict:
+        return {
+            'samples': self._size,
+            'last': self.last,
+            'mean': self.mean(now=now),
+            'ewma': self.ewma,
+            'median': self.percentile(50, now=now),
+            'p90': self.percentile(90, now=now),
+            'max': self.maximum(now=now),
+            'trend_per_minute': self.trend(now=now),
+        }
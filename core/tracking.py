@@ -0,0 +1,239 @@
+import copy
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from core.model import detect_frame, scale_detections
+
+# Approach name used when no lanes are configured
+ALL_LANES = 'all'
+
+
+class TrackState:
+    __slots__ = ('lane', 'entered_at', 'anchor', 'seen_at', 'speed')
+
+    def __init__(self, lane: str, anchor: np.ndarray, timestamp: float):
+        self.lane = lane
+        self.entered_at = timestamp
+        self.anchor = anchor
+        self.seen_at = timestamp
+        self.speed = None
+
+
+class TrafficTracker:
+    """
+    Follows vehicles across frames with ByteTrack so each one keeps a stable id.
+    Every update only touches the vehicles of that frame: their lane, speed and time in the lane.
+    A vehicle is queued while it moves slower than queue_speed (frame heights per second),
+    it has departed once its track has been lost for lost_seconds, which gives flow and dwell time per lane.
+    """
+
+    def __init__(self, roi=None, frame_rate: float = 15, queue_speed: float = 0.02, lost_seconds: float = 2.0,
+                 flow_window: float = 60.0):
+        import supervision as sv
+
+        self.roi = roi
+        self.frame_rate = frame_rate
+        self.queue_speed = queue_speed
+        self.lost_seconds = lost_seconds
+        self.flow_window = flow_window
+        self.tracker = sv.ByteTrack(frame_rate=frame_rate, lost_track_buffer=max(1, int(lost_seconds * frame_rate)))
+
+        lane_names = [lane.name for lane in roi.lanes] if roi is not None and roi.lanes else [ALL_LANES]
+        self._tracks = {}
+        self._departures = {lane: deque() for lane in lane_names}
+        self._dwell_times = {lane: deque(maxlen=50) for lane in lane_names}
+        self._departed = dict.fromkeys(lane_names, 0)
+        self._line_zones = None
+        self.frames = 0
+
+    def _create_line_zones(self, shape) -> dict:
+        import supervision as sv
+
+        if self.roi is None:
+            return {}
+        return {
+            name: sv.LineZone(
+                start=sv.Point(float(start[0]), float(start[1])),
+                end=sv.Point(float(end[0]), float(end[1])),
+                triggering_anchors=[sv.Position.BOTTOM_CENTER],
+            )
+            for name, (start, end) in self.roi.lines_for(shape).items()
+        }
+
+    def update(self, detections, shape, timestamp: Optional[float] = None):
+        """Track the vehicle detections of the next frame, returns them with their tracker_id set"""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        # ByteTrack sets tracker_id on the detections it is given, these may be shared by the detection cache
+        tracked = self.tracker.update_with_detections(copy.deepcopy(detections))
+        self.frames += 1
+
+        if self._line_zones is None:
+            self._line_zones = self._create_line_zones(shape)
+        for zone in self._line_zones.values():
+            zone.trigger(tracked)
+
+        lanes = self._lanes_of(tracked, shape)
+        anchors = np.column_stack([(tracked.xyxy[:, 0] + tracked.xyxy[:, 2]) / 2, tracked.xyxy[:, 3]])
+        height = shape[0]
+
+        for tracker_id, lane, anchor in zip(tracked.tracker_id, lanes, anchors):
+            state = self._tracks.get(tracker_id)
+            if state is None:
+                self._tracks[tracker_id] = TrackState(lane, anchor, timestamp)
+                continue
+
+            elapsed = timestamp - state.seen_at
+            if elapsed > 0:
+                speed = float(np.hypot(*(anchor - state.anchor))) / height / elapsed
+                # Smoothed, a single jittery box shouldn't release a vehicle from the queue
+                state.speed = speed if state.speed is None else 0.5 * state.speed + 0.5 * speed
+            if lane != state.lane:
+                self._depart(state, timestamp)
+                state.lane = lane
+                state.entered_at = timestamp
+            state.anchor = anchor
+            state.seen_at = timestamp
+
+        for tracker_id in [tid for tid, state in self._tracks.items() if timestamp - state.seen_at > self.lost_seconds]:
+            state = self._tracks.pop(tracker_id)
+            self._depart(state, state.seen_at)
+
+        return tracked
+
+    def _lanes_of(self, tracked, shape) -> list:
+        if self.roi is None or not self.roi.lanes:
+            return [ALL_LANES] * len(tracked)
+        lanes = [None] * len(tracked)
+        for name, mask in self.roi.lane_masks(tracked, shape).items():
+            for index in np.flatnonzero(mask):
+                if lanes[index] is None:
+                    lanes[index] = name
+        return lanes
+
+    def _depart(self, state: TrackState, timestamp: float):
+        if state.lane is None:
+            return
+        self._departed[state.lane] += 1
+        self._departures[state.lane].append(timestamp)
+        self._dwell_times[state.lane].append(timestamp - state.entered_at)
+
+    def snapshot(self, timestamp: Optional[float] = None) -> dict:
+        """Vehicles, queue, dwell time and flow per lane, and the crossings of each counting line"""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        lanes = {}
+        for lane, departures in self._departures.items():
+            while departures and timestamp - departures[0] > self.flow_window:
+                departures.popleft()
+            present = [state for state in self._tracks.values() if state.lane == lane]
+            dwell_times = self._dwell_times[lane]
+            lanes[lane] = {
+                'vehicles': len(present),
+                'queue': sum(1 for state in present if state.speed is not None and state.speed < self.queue_speed),
+                'dwell_avg': float(np.mean([timestamp - state.entered_at for state in present])) if present else 0.0,
+                'dwell_completed_avg': float(np.mean(dwell_times)) if dwell_times else None,
+                'departed': self._departed[lane],
+                'flow_per_minute': len(departures) * 60 / self.flow_window,
+            }
+
+        return {
+            'lanes': lanes,
+            'lines': {
+                name: {'in': zone.in_count, 'out': zone.out_count}
+                for name, zone in (self._line_zones or {}).items()
+            },
+            'tracks': len(self._tracks),
+            'frames': self.frames,
+        }
+
+
+class TrackingWorker:
+    """
+    Runs detection and tracking on a FrameGrabber's model-sized frames in its own thread, at most fps frames
+    per second. Frames in between are skipped, the grabber always hands over the newest one. Stops with the grabber.
+    The tracked detections it shares are scaled to the grabber's display-sized frames.
+    """
+
+    def __init__(self, grabber, roi=None, fps: float = 15, **tracker_options):
+        self.grabber = grabber
+        self.roi = roi
+        self.fps = fps
+        self.tracker = TrafficTracker(roi, frame_rate=fps, **tracker_options)
+
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._detections = None
+        self._process_times = deque(maxlen=60)
+        self._frame_times = deque(maxlen=60)
+        self.error = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='tracking', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running and self.grabber.running
+
+    def _run(self):
+        interval = 1 / self.fps
+        last_seq = 0
+        try:
+            while self.running:
+                started_at = time.monotonic()
+                seq, frame, scale = self.grabber.read_model()
+                if seq == last_seq or frame is None:
+                    time.sleep(interval / 4)
+                    continue
+                last_seq = seq
+
+                detections = detect_frame(frame, self.roi)
+                if not self.grabber.valid(seq):
+                    # The process pipeline's capture reused the slot during inference, the frame may be torn
+                    continue
+                tracked = self.tracker.update(detections, frame.shape, started_at)
+                snapshot = self.tracker.snapshot(started_at)
+                with self._lock:
+                    self._detections = scale_detections(tracked, scale)
+                    self._snapshot = snapshot
+
+                finished_at = time.monotonic()
+                self._process_times.append(finished_at - started_at)
+                self._frame_times.append(finished_at)
+                delay = interval - (finished_at - started_at)
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            print(f"Error tracking vehicles: {e}")
+            self.error = str(e)
+        finally:
+            self._running = False
+
+    def latest(self):
+        """(snapshot, tracked detections) of the last processed frame, (None, None) before the first one"""
+        with self._lock:
+            return self._snapshot, self._detections
+
+    def get_stats(self) -> dict:
+        frame_times = list(self._frame_times)
+        fps = 0.0
+        if len(frame_times) > 1 and frame_times[-1] > frame_times[0]:
+            fps = (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+        process_times = list(self._process_times)
+        snapshot, _ = self.latest()
+        return {
+            'running': self.running,
+            'fps': fps,
+            'process_ms': sum(process_times) / len(process_times) * 1000 if process_times else None,
+            'error': self.error,
+            **(snapshot or {}),
+        }
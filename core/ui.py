@@ -1,39 +1,196 @@
 from nicegui import ui, app
 import cv2
 import asyncio
+import time
 from pathlib import Path
 import urllib.parse
 from fastapi import Response
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
-from prometheus_client.decorator import contextmanager
+from contextlib import contextmanager
 
 from components.header import header
 from components.info_pannel import info_panel
-from components.traffic_lights import create_traffic_light
+from components.traffic_lights import TrafficLightWidget
+from core.config import (
+    MOTION_GATE_ENABLED, MOTION_PIXEL_THRESHOLD, MOTION_CHANGED_RATIO, MOTION_MAX_SKIP_SECONDS,
+    TRACKING_ENABLED, TRACKING_FPS, TRACKING_QUEUE_SPEED, TRACKING_LOST_SECONDS,
+    DECODE_THREADS, DECODE_HW_ACCELERATION, DECODE_EVERY_NTH, DECODE_KEYFRAMES_ONLY, DECODE_WIDTH, DISPLAY_WIDTH,
+    MODEL_FRAME_SIZE, STREAM_MAX_FPS, STREAM_MIN_FPS, STREAM_CPU_HIGH, STREAM_CPU_LOW,
+    PROCESS_PIPELINE, FRAME_RING_SLOTS, PROCESS_INFERENCE_FPS, HISTORY_DIR, HISTORY_FLUSH_SECONDS,
+    HISTORY_RETENTION_DAYS
+)
 from core.controller import (
-    get_current_color, update_vehicle_count,
-    start_traffic_light, traffic_light_running, calculate_and_store_max_time
+    get_current_color, update_vehicle_count, update_lane_counts, update_counts, start_traffic_light,
+    is_traffic_light_running, calculate_and_store_max_time, should_trigger_detection, clear_detection_flag, subscribe,
+    record_history
 )
-from core.model import count_cars_from_frame
-from utils.streaming_utils import frame_to_base64, open_media_source
+from core.detection_service import detection_service, detect_cars
+from core.metrics import scrape, cache_stats, query_history
+from core.model import model_manager, annotate_frame, scale_detections
+from core.process_pipeline import ProcessGrabber
+from core.roi import RegionOfInterest
+from core.tracking import TrackingWorker
+from utils.adaptive_stream import AdaptiveStream
+from utils.decoder import DecodeOptions
+from utils.frame_grabber import FrameGrabber
+from utils.broadcaster import FrameBroadcaster
+from utils.motion import MotionGate
+from utils.metrics import monitor_event_loop
+from utils.streaming_utils import frame_to_base64, mjpeg_part, MJPEG_BOUNDARY
+from utils.timeseries_store import TimeSeriesStore
 
 media_capture = {'value': None}
 is_streaming = {'value': False}
+# Newest frame as displayed, with the process pipeline a view of shared memory that is soon overwritten
 current_frame = {'value': None}
+decode_options = DecodeOptions(
+    threads=DECODE_THREADS,
+    hw_acceleration=DECODE_HW_ACCELERATION,
+    every_nth=DECODE_EVERY_NTH,
+    keyframes_only=DECODE_KEYFRAMES_ONLY,
+    decode_width=DECODE_WIDTH,
+    display_width=DISPLAY_WIDTH,
+    model_size=MODEL_FRAME_SIZE,
+)
+# Detections of the last controller-triggered detection, drawn on the stream for a short while
+last_detections = {'value': None, 'time': 0.0}
+ANNOTATION_MAX_AGE = 1.0
+# Lane polygons per source path as (text typed in the media panel, RegionOfInterest), and the loaded source's
+lane_regions = {}
+active_roi = {'value': None}
+# Shares the RTSP frames between every viewer of /stream.mjpg, replaced for each new stream
+stream_broadcaster = {'value': FrameBroadcaster(), 'id': 0}
+# Adaptive rate controllers of the connected /stream.mjpg clients
+stream_clients = set()
+# Skips detections of video and RTSP frames that look the same as the last detected one
+motion_gate = MotionGate(
+    pixel_threshold=MOTION_PIXEL_THRESHOLD,
+    changed_ratio=MOTION_CHANGED_RATIO,
+    max_skip_seconds=MOTION_MAX_SKIP_SECONDS,
+)
+# Continuous tracking of the current video or RTSP source, when enabled
+tracking_worker = {'value': None}
+
+
+def create_grabber(source_type: str, source_path: str):
+    if PROCESS_PIPELINE:
+        return ProcessGrabber(source_type, source_path, options=decode_options, roi=active_roi['value'],
+                              slots=FRAME_RING_SLOTS, inference_fps=PROCESS_INFERENCE_FPS)
+    return FrameGrabber(source_type, source_path, options=decode_options)
+
+
+async def start_source(grabber) -> bool:
+    """Open the grabber's source, lane polygons are scaled from its native size to the decoded frames"""
+    # Opening blocks until the first frame is decoded, the event loop keeps serving meanwhile
+    if not await asyncio.get_running_loop().run_in_executor(None, grabber.start):
+        return False
+    if active_roi['value'] is not None:
+        active_roi['value'].set_source_size(grabber.source_size)
+    return True
+
+
+def start_tracking(grabber):
+    if not TRACKING_ENABLED:
+        return
+    worker = TrackingWorker(
+        grabber, active_roi['value'], fps=TRACKING_FPS,
+        queue_speed=TRACKING_QUEUE_SPEED, lost_seconds=TRACKING_LOST_SECONDS,
+    )
+    worker.start()
+    tracking_worker['value'] = worker
+
+
+def tracked_snapshot():
+    worker = tracking_worker['value']
+    if worker is None or not worker.running:
+        return None, None
+    return worker.latest()
+
+
+async def detect_and_update(frame, scale: float = 1.0):
+    """Detect on the (model-sized) frame, scale maps its coordinates to the displayed frame for the overlay"""
+    roi = active_roi['value']
+    snapshot, _ = tracked_snapshot()
+    if snapshot is not None:
+        # The tracker already knows which vehicles are in each lane, no extra inference needed
+        lanes = snapshot['lanes']
+        if roi is None or not roi.lanes:
+            update_vehicle_count(sum(lane['vehicles'] for lane in lanes.values()))
+        else:
+            update_lane_counts({name: lane['vehicles'] for name, lane in lanes.items()})
+        calculate_and_store_max_time()
+        return
+    grabber = media_capture['value']
+    if isinstance(grabber, ProcessGrabber):
+        # The inference process keeps detecting the newest frame, its last result is at most a frame interval old
+        result = grabber.latest_detections()
+        if result is not None:
+            detections, shape, scale = result
+            last_detections['value'] = scale_detections(detections, scale)
+            last_detections['time'] = time.monotonic()
+            update_counts(detections, shape, roi)
+            calculate_and_store_max_time()
+            return
+    if MOTION_GATE_ENABLED and not motion_gate.should_detect(roi.crop(frame)[0] if roi is not None else frame):
+        # Nothing moved since the last detection, its count still holds
+        calculate_and_store_max_time()
+        return
+    try:
+        detections = await detect_cars(frame, roi)
+    except Exception as e:
+        print(f"Error detecting cars: {e}")
+        motion_gate.reset()
+        return
+    last_detections['value'] = scale_detections(detections, scale)
+    last_detections['time'] = time.monotonic()
+    update_counts(detections, frame.shape, roi)
+    # Calculate and store max time based on detected count
+    calculate_and_store_max_time()
+
+
+def detection_overlay():
+    _, tracked = tracked_snapshot()
+    if tracked is not None:
+        return lambda frame: annotate_frame(frame, tracked)
+    detections = last_detections['value']
+    if detections is None or time.monotonic() - last_detections['time'] > ANNOTATION_MAX_AGE:
+        return None
+    return lambda frame: annotate_frame(frame, detections)
+
 
+def detection_frame():
+    """(frame, scale to the displayed frame) to detect on: the source's newest model-sized frame, or the image"""
+    grabber = media_capture['value']
+    if grabber is None:
+        return current_frame['value'], 1.0
+    # Only read, and copied out of shared memory, when a detection is due
+    seq, frame, scale = grabber.read_model()
+    return (grabber.keep(seq, frame) if frame is not None else None), scale
 
 
+def trigger_detection_if_needed():
+    # The controller asks for a detection when the light turns red or green
+    if should_trigger_detection() and current_frame['value'] is not None:
+        frame, scale = detection_frame()
+        if frame is None:
+            return
+        # Clear the flag first so the same detection is never requested twice
+        clear_detection_flag()
+        # Run detection in the worker pool, the event loop keeps going meanwhile
+        asyncio.create_task(detect_and_update(frame, scale))
 
 
+subscribe(lambda event: trigger_detection_if_needed())
+
 
 async def stream_media(media_image, media_static_image, media_video, source_type: str, source_path: str):
     global media_capture, is_streaming, current_frame
 
-    if media_capture['value'] is not None and isinstance(media_capture['value'], cv2.VideoCapture):
+    if media_capture['value'] is not None:
         is_streaming['value'] = False
         await asyncio.sleep(0.1)  # Give time for loop to exit
-        media_capture['value'].release()
+        media_capture['value'].stop()
         media_capture['value'] = None
 
     is_streaming['value'] = False
@@ -43,17 +200,25 @@ async def stream_media(media_image, media_static_image, media_video, source_type
             frame = cv2.imread(source_path)
             if frame is not None:
                 current_frame['value'] = frame
-                vehicle_count, annotated_frame = count_cars_from_frame(frame)
-                update_vehicle_count(vehicle_count)
+                if active_roi['value'] is not None:
+                    active_roi['value'].set_source_size(None)
+                try:
+                    detections = await detect_cars(frame, active_roi['value'])
+                except Exception as e:
+                    print(f"Error detecting cars: {e}")
+                    detections = None
+                if detections is not None:
+                    update_counts(detections, frame.shape, active_roi['value'])
+                else:
+                    update_vehicle_count(0)
                 # Calculate and store max time based on detected count
                 calculate_and_store_max_time()
                 # Use annotated frame for display (static image, not streaming)
-                if annotated_frame is not None:
-                    img_base64 = frame_to_base64(annotated_frame)
-                    media_static_image.source = f'data:image/jpeg;base64,{img_base64}'
+                if detections is not None:
+                    img_base64 = frame_to_base64(annotate_frame(frame, detections))
                 else:
                     img_base64 = frame_to_base64(frame)
-                    media_static_image.source = f'data:image/jpeg;base64,{img_base64}'
+                media_static_image.source = f'data:image/jpeg;base64,{img_base64}'
                 media_static_image.style('display: block;')
                 media_image.style('display: none;')
                 media_video.style('display: none;')
@@ -84,33 +249,33 @@ async def stream_media(media_image, media_static_image, media_video, source_type
 
             # Start background processing for vehicle detection on video
             # We'll process frames in the background for vehicle counting
-            cap = cv2.VideoCapture(str(video_path))
-            if cap.isOpened():
-                media_capture['value'] = cap
+            grabber = create_grabber('video', str(video_path))
+            if await start_source(grabber):
+                media_capture['value'] = grabber
                 is_streaming['value'] = True
+                start_tracking(grabber)
 
                 # Start traffic light state machine if not already running
-                if not traffic_light_running['value']:
+                if not is_traffic_light_running():
                     start_traffic_light()
 
                 # Background frame processing - just store frames for detection on color change
                 async def process_video_frames():
+                    last_seq = 0
                     try:
-                        while is_streaming['value']:
-                            ret, frame = cap.read()
-                            if not ret:
-                                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        while is_streaming['value'] and grabber.running:
+                            latest = await grabber.next_frame(last_seq)
+                            if latest is None:
                                 continue
 
                             # Store current frame for detection (will be used when color changes)
+                            last_seq, _, frame = latest
                             current_frame['value'] = frame
-
-                            await asyncio.sleep(0.1)  # Process every 100ms
+                            trigger_detection_if_needed()
                     except Exception as e:
                         print(f"Error processing video frames: {e}")
                     finally:
-                        if isinstance(cap, cv2.VideoCapture):
-                            cap.release()
+                        grabber.stop()
 
                 asyncio.create_task(process_video_frames())
                 ui.notify('Video loaded successfully', type='positive')
@@ -122,50 +287,64 @@ async def stream_media(media_image, media_static_image, media_video, source_type
         return
 
     # Handle RTSP stream (use interactive_image for efficient frame updates)
-    cap = open_media_source(source_type, source_path)
-    if cap is None:
+    grabber = create_grabber(source_type, source_path)
+    if not await start_source(grabber):
         media_image.source = ''
         ui.notify(f'Failed to open {source_type} source. Please check the path/URL.', type='negative')
         return
 
-    media_capture['value'] = cap
+    media_capture['value'] = grabber
     is_streaming['value'] = True
+    start_tracking(grabber)
 
     # Show interactive_image element, hide video and static image elements for RTSP
+    # The browser pulls frames over HTTP, the query string forces it to reconnect to the new stream
+    stream_broadcaster['value'].close()
+    broadcaster = FrameBroadcaster()
+    stream_broadcaster['value'] = broadcaster
+    stream_broadcaster['id'] += 1
+    media_image.source = f'/stream.mjpg?stream={stream_broadcaster["id"]}'
     media_image.style('display: block;')
     media_static_image.style('display: none;')
     media_video.style('display: none;')
 
     # Start traffic light state machine if not already running
-    if not traffic_light_running['value']:
+    if not is_traffic_light_running():
         start_traffic_light()
 
-    # Background frame processing - ui.interactive_image handles updates efficiently
+    # Background frame processing - the grabber thread reads the stream, we only push the newest frame
     async def process_rtsp_frames():
+        last_seq = 0
         try:
-            while is_streaming['value']:
-                ret, frame = cap.read()
-                if not ret:
-                    # RTSP connection lost, try to reconnect
-                    await asyncio.sleep(1)
+            while is_streaming['value'] and grabber.running:
+                latest = await grabber.next_frame(last_seq)
+                if latest is None:
+                    # No new frame, the grabber is reconnecting
                     continue
 
                 # Store current frame for detection (will be used when color changes)
+                last_seq, _, frame = latest
                 current_frame['value'] = frame
+                trigger_detection_if_needed()
 
-                # Update interactive_image - it automatically adapts frame rate to bandwidth
-                img_base64 = frame_to_base64(frame)
-                media_image.source = f'data:image/jpeg;base64,{img_base64}'
+                # Encoded lazily once per quality, every /stream.mjpg viewer receives the same bytes.
+                # Boxes of a recent detection are drawn at that point too, only if someone is watching.
+                # The broadcaster holds the frame until then, out of shared memory with the process pipeline.
+                frame = grabber.keep(last_seq, frame)
+                if frame is not None:
+                    broadcaster.publish(frame, detection_overlay())
 
-                await asyncio.sleep(0.033)  # ~30 FPS
+                # Publish at most STREAM_MAX_FPS, frames in between are skipped. Each client is paced lower if needed.
+                await asyncio.sleep(1 / STREAM_MAX_FPS)
         except Exception as e:
             ui.notify(f'Error streaming RTSP: {e}', type='negative')
             print(f"Error streaming RTSP: {e}")
         finally:
-            if isinstance(cap, cv2.VideoCapture):
-                cap.release()
-            is_streaming['value'] = False
-            media_capture['value'] = None
+            grabber.stop()
+            broadcaster.close()
+            if media_capture['value'] is grabber:
+                is_streaming['value'] = False
+                media_capture['value'] = None
 
     asyncio.create_task(process_rtsp_frames())
     ui.notify('RTSP stream started successfully', type='positive')
@@ -216,6 +395,19 @@ def scene_section():
 
                     ui_refs['source_path_input'] = source_path_input
 
+                    lanes_input = ui.textarea(
+                        label='Lanes (optional)',
+                        placeholder='north: 120,400 520,400 560,720 80,720'
+                    ).props('autogrow').style('width: 100%; margin-bottom: 0.75rem;')
+                    lanes_input.tooltip('One lane per line, polygon corners in source pixels. '
+                                        'Only these areas are analysed and counted.')
+
+                    ui_refs['lanes_input'] = lanes_input
+
+                    # Show the lanes already configured for a source when it's selected again
+                    source_path_input.on_value_change(
+                        lambda e: lanes_input.set_value(lane_regions.get(e.value.strip(), ('', None))[0]))
+
                     with ui.row().classes('justify-end q-gutter-sm'):
                         load_button = ui.button('Load', icon='play_arrow', color='primary')
                         ui_refs['load_button'] = load_button
@@ -271,12 +463,24 @@ def scene_section():
                         ui.notify('Please enter a source path', type='warning')
                         return
 
+                    lanes_text = ui_refs['lanes_input'].value or ''
+                    try:
+                        roi = RegionOfInterest.parse(lanes_text)
+                    except ValueError as e:
+                        ui.notify(f'Invalid lanes: {e}', type='warning')
+                        return
+                    if roi is None:
+                        lane_regions.pop(source_path, None)
+                    else:
+                        lane_regions[source_path] = (lanes_text, roi)
+                    active_roi['value'] = roi
+                    motion_gate.reset()
+
                     is_streaming['value'] = False
                     await asyncio.sleep(0.1)
 
                     if media_capture['value'] is not None:
-                        if isinstance(media_capture['value'], cv2.VideoCapture):
-                            media_capture['value'].release()
+                        media_capture['value'].stop()
                         media_capture['value'] = None
 
                     current_frame['value'] = None
@@ -303,11 +507,92 @@ def traffic_section():
 
             color = get_current_color()
 
-            create_traffic_light(color)
+            traffic_light = TrafficLightWidget(color)
 
             ui.separator()
 
-            info_panel(current_frame)
+            info_panel(traffic_light)
+
+
+# Load the model in the background so the first page doesn't wait for torch and the weights
+app.on_startup(model_manager.start_background_load)
+
+event_loop_monitor = {'value': None}
+
+
+def start_event_loop_monitor():
+    event_loop_monitor['value'] = asyncio.create_task(monitor_event_loop())
+
+
+app.on_startup(start_event_loop_monitor)
+
+# Persistent count and phase history, when a directory is configured
+history_store = {'value': None}
+
+
+def start_history():
+    if HISTORY_DIR:
+        store = TimeSeriesStore(HISTORY_DIR, HISTORY_FLUSH_SECONDS, HISTORY_RETENTION_DAYS)
+        store.start()
+        record_history(store)
+        history_store['value'] = store
+
+
+def stop_history():
+    store = history_store['value']
+    if store is not None:
+        record_history(None)
+        store.close()
+        history_store['value'] = None
+
+
+app.on_startup(start_history)
+app.on_shutdown(stop_history)
+
+
+@app.get('/model/status')
+async def model_status():
+    return model_manager.status()
+
+
+@app.get('/detection/status')
+async def detection_status():
+    return {
+        'service': detection_service.get_metrics(),
+        'motion_gate': motion_gate.get_stats(),
+        'cache': cache_stats(media_capture['value']),
+    }
+
+
+@app.get('/tracking/status')
+async def tracking_status():
+    worker = tracking_worker['value']
+    return worker.get_stats() if worker is not None else {'running': False}
+
+
+@app.get('/metrics')
+async def metrics():
+    """Prometheus scrape"""
+    grabber = media_capture['value']
+    body, content_type = scrape(grabber.source_type if grabber is not None else None, grabber)
+    return Response(content=body, media_type=content_type)
+
+
+@app.get('/history')
+async def history(series: str = 'main', hours: float = 24, interval: float = 300):
+    """Count rollups of one series (a light id, or 'light/lane') over the last hours"""
+    store = history_store['value']
+    if store is None:
+        return Response(status_code=404)
+    try:
+        return await query_history(store, series, hours, interval)
+    except ValueError:
+        return Response(status_code=400)
+
+
+@app.get('/stream/status')
+async def stream_status():
+    return {**stream_broadcaster['value'].get_stats(), 'clients': [stream.get_stats() for stream in stream_clients]}
 
 
 @app.get('/video')
@@ -328,6 +613,45 @@ async def serve_video(file_path: str):
         return Response(status_code=500)
 
 
+@app.get('/stream.mjpg')
+async def serve_stream(quality: int = 85, adaptive: bool = True):
+    """
+    Serve the RTSP feed as multipart MJPEG, frames are shared with every other viewer.
+    Frame rate, size and quality (at most the requested one) adapt to how fast this client receives them.
+    """
+    quality = min(max(quality, 10), 95)
+    subscription = stream_broadcaster['value'].subscribe(quality)
+    stream = AdaptiveStream(
+        subscription,
+        max_fps=STREAM_MAX_FPS,
+        # Without adaptation the client stays on the first level
+        min_fps=STREAM_MIN_FPS if adaptive else STREAM_MAX_FPS,
+        max_quality=quality,
+        cpu_high=STREAM_CPU_HIGH,
+        cpu_low=STREAM_CPU_LOW,
+    )
+    stream_clients.add(stream)
+
+    async def frames():
+        try:
+            while not subscription.broadcaster.closed:
+                jpeg = await stream.next()
+                if jpeg:
+                    # The generator resumes once the part is handed to the socket, slow links take longer
+                    sent_at = time.perf_counter()
+                    yield mjpeg_part(jpeg)
+                    stream.record_send(time.perf_counter() - sent_at)
+        finally:
+            stream_clients.discard(stream)
+            subscription.close()
+
+    return StreamingResponse(
+        frames(),
+        media_type=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}',
+        headers={'Cache-Control': 'no-cache, no-store'}
+    )
+
+
 @ui.page('/')
 def main_page():
     ui.query('body').style('background-color: #f5f5f5; margin: 0; padding: 0;')
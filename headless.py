@@ -0,0 +1,32 @@
+"""
+Runs the traffic light controller of one video or RTSP source without the NiceGUI dashboard, for devices
+that never show a screen. Phase state and counts are served as JSON and pushed over a WebSocket:
+python headless.py --source rtsp://camera/stream --port 8189
+"""
+import argparse
+from pathlib import Path
+
+from aiohttp import web
+
+from core.headless import HeadlessService, create_app
+from core.roi import RegionOfInterest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', required=True, help='Video file or RTSP URL')
+    parser.add_argument('--type', choices=('video', 'rtsp'), help='Source type, guessed from --source when omitted')
+    parser.add_argument('--lanes', help="File with lane polygons, one 'name: x1,y1 x2,y2 ...' per line")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8189)
+    args = parser.parse_args()
+
+    source_type = args.type or ('rtsp' if '://' in args.source else 'video')
+    roi = RegionOfInterest.parse(Path(args.lanes).read_text()) if args.lanes else None
+
+    service = HeadlessService(source_type, args.source, roi)
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
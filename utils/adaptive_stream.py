@@ -0,0 +1,122 @@
+import asyncio
+import time
+from typing import Optional
+
+# Steps from best to cheapest as (frames per second, scale, JPEG quality).
+# Frame rate goes first, then quality, resolution only when a client is far behind.
+STREAM_LEVELS = (
+    (30, 1.0, 85),
+    (20, 1.0, 80),
+    (15, 1.0, 70),
+    (10, 0.75, 65),
+    (5, 0.75, 55),
+    (2, 0.5, 45),
+)
+
+_cpu = {'value': 0.0, 'time': 0.0}
+
+
+def cpu_load() -> float:
+    """System CPU utilization in percent, sampled at most once per second for every client together"""
+    now = time.monotonic()
+    if now - _cpu['time'] >= 1.0:
+        try:
+            import psutil
+
+            _cpu['value'] = psutil.cpu_percent(interval=None)
+        except ImportError:
+            _cpu['value'] = 0.0
+        _cpu['time'] = now
+    return _cpu['value']
+
+
+class AdaptiveStream:
+    """
+    Paces one MJPEG client and picks its frame rate, scale and JPEG quality from STREAM_LEVELS.
+    A frame taking long to send (slow link, the socket buffer is full) or a busy CPU moves the client one level down,
+    when sends are fast and the CPU has headroom for restore_after seconds it moves one level back up.
+    The frame rate never drops below min_fps, a client too slow even for that just skips frames.
+    """
+
+    def __init__(self, subscription, max_fps: float = 30, min_fps: float = 2, max_quality: int = 85,
+                 cpu_high: float = 85.0, cpu_low: float = 60.0, cooldown: float = 2.0, restore_after: float = 5.0):
+        self.subscription = subscription
+        self.max_quality = max_quality
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.cooldown = cooldown
+        self.restore_after = restore_after
+
+        # The best scale and quality at max_fps, then the levels of lower frame rates down to min_fps.
+        # Levels above max_fps are left out, clamping them would repeat one frame rate at falling quality.
+        levels = [(max_fps, *STREAM_LEVELS[0][1:])]
+        levels += [level for level in STREAM_LEVELS if min_fps <= level[0] < max_fps]
+        self.levels = [(fps, scale, min(quality, max_quality)) for fps, scale, quality in levels]
+        self.level = 0
+        self.send_time = None
+        self.changes = 0
+        self._changed_at = time.monotonic()
+        self._healthy_since = None
+        self._next_at = 0.0
+        self._apply()
+
+    def _apply(self):
+        fps, scale, quality = self.levels[self.level]
+        self.subscription.quality = quality
+        self.subscription.scale = scale
+
+    @property
+    def fps(self) -> float:
+        return self.levels[self.level][0]
+
+    async def next(self, timeout: float = 1.0) -> Optional[bytes]:
+        """Next JPEG for this client, no sooner than its frame rate allows"""
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        jpeg = await self.subscription.next(timeout)
+        if jpeg:
+            self._next_at = time.monotonic() + 1 / self.fps
+        return jpeg
+
+    def record_send(self, seconds: float):
+        """Time the last frame took to be handed to the client's socket"""
+        self.send_time = seconds if self.send_time is None else 0.7 * self.send_time + 0.3 * seconds
+        now = time.monotonic()
+        budget = 1 / self.fps
+        cpu = cpu_load()
+
+        if self.send_time > 0.8 * budget or cpu > self.cpu_high:
+            self._healthy_since = None
+            if self.level < len(self.levels) - 1 and now - self._changed_at >= self.cooldown:
+                self._change(self.level + 1, now)
+            return
+
+        # Only step up when the better level's frame interval would still have plenty of room
+        if self.level > 0 and self.send_time < 0.3 / self.levels[self.level - 1][0] and cpu < self.cpu_low:
+            if self._healthy_since is None:
+                self._healthy_since = now
+            elif now - self._healthy_since >= self.restore_after and now - self._changed_at >= self.cooldown:
+                self._change(self.level - 1, now)
+        else:
+            self._healthy_since = None
+
+    def _change(self, level: int, now: float):
+        self.level = level
+        self._changed_at = now
+        self._healthy_since = None
+        self.changes += 1
+        self._apply()
+
+    def get_stats(self) -> dict:
+        fps, scale, quality = self.levels[self.level]
+        return {
+            'level': self.level,
+            'fps': fps,
+            'scale': scale,
+            'quality': quality,
+            'send_ms': self.send_time * 1000 if self.send_time is not None else None,
+            'changes': self.changes,
+            'sent': self.subscription.sent,
+            'skipped': self.subscription.skipped,
+        }
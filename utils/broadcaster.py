@@ -0,0 +1,120 @@
+import asyncio
+from typing import Callable, Optional
+
+import numpy as np
+
+from utils.decoder import resize_to_width
+from utils.streaming_utils import frame_to_jpeg
+
+
+class FrameBroadcaster:
+    """
+    Shares one stream of frames between any number of viewers.
+    Each frame is encoded at most once per JPEG quality and scale, and only when a viewer asks for it.
+    An overlay (e.g. detection boxes) published with the frame is drawn at that point too, never for unwatched frames.
+    Every subscriber only holds the sequence number of the last frame it sent, so a slow
+    client skips to the newest frame instead of building up a queue.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._overlay = None
+        self._seq = 0
+        self._encoded = {}
+        self._subscribers = set()
+        self.closed = False
+
+        self.published = 0
+        self.encodes = 0
+
+    def publish(self, frame: np.ndarray, overlay: Optional[Callable[[np.ndarray], np.ndarray]] = None):
+        self._frame = frame
+        self._overlay = overlay
+        self._seq += 1
+        self._encoded = {}
+        self.published += 1
+        for subscription in self._subscribers:
+            subscription.wake()
+
+    def close(self):
+        self.closed = True
+        for subscription in list(self._subscribers):
+            subscription.wake()
+
+    def subscribe(self, quality: int = 85, scale: float = 1.0) -> 'Subscription':
+        subscription = Subscription(self, quality, scale)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: 'Subscription'):
+        self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def encoded(self, quality: int, scale: float = 1.0) -> tuple[int, bytes]:
+        """Return (sequence number, JPEG bytes) of the current frame, encoding it once per quality and scale"""
+        seq, frame, overlay = self._seq, self._frame, self._overlay
+        task = self._encoded.get((quality, scale))
+        if task is None:
+            # Encode off the event loop, viewers asking for the same variant meanwhile share the result
+            task = asyncio.ensure_future(asyncio.to_thread(render_jpeg, frame, overlay, quality, scale))
+            self._encoded[(quality, scale)] = task
+            self.encodes += 1
+        return seq, await task
+
+    def get_stats(self) -> dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'encodes': self.encodes,
+            'skipped': sum(subscription.skipped for subscription in self._subscribers),
+        }
+
+
+def render_jpeg(frame: np.ndarray, overlay, quality: int, scale: float = 1.0) -> bytes:
+    if overlay is not None:
+        frame = overlay(frame)
+    if scale != 1.0:
+        frame = resize_to_width(frame, round(frame.shape[1] * scale))
+    return frame_to_jpeg(frame, quality)
+
+
+class Subscription:
+
+    def __init__(self, broadcaster: FrameBroadcaster, quality: int, scale: float = 1.0):
+        self.broadcaster = broadcaster
+        # Either can change between frames, e.g. by an AdaptiveStream
+        self.quality = quality
+        self.scale = scale
+        self.last_seq = 0
+        self.sent = 0
+        self.skipped = 0
+        self._wakeup = asyncio.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def next(self, timeout: float = 1.0) -> Optional[bytes]:
+        """Wait for a frame newer than the last one sent, None on timeout or when the stream ended"""
+        broadcaster = self.broadcaster
+        if broadcaster._seq == self.last_seq and not broadcaster.closed:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        if broadcaster.closed or broadcaster._seq == self.last_seq:
+            return None
+
+        seq, jpeg = await broadcaster.encoded(self.quality, self.scale)
+        if self.last_seq:
+            self.skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.sent += 1
+        return jpeg
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
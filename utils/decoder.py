@@ -0,0 +1,190 @@
+import shutil
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class DecodeOptions:
+    """
+    How a video or RTSP source is decoded.
+    threads and hw_acceleration are passed to OpenCV's FFmpeg backend. keyframes_only and decode_width need
+    FFmpeg itself to decode (skip non-key frames, scale before the BGR conversion), they use FFmpegReader.
+    Every decoded frame is then reduced once to a display-sized frame and a model-sized frame.
+    """
+
+    def __init__(self, threads: int = 0, hw_acceleration: bool = False, every_nth: int = 1,
+                 keyframes_only: bool = False, decode_width: int = 0, display_width: int = 0, model_size: int = 0):
+        self.threads = threads
+        self.hw_acceleration = hw_acceleration
+        # Only every Nth frame is converted to BGR, the others are grabbed and dropped
+        self.every_nth = max(1, every_nth)
+        self.keyframes_only = keyframes_only
+        self.decode_width = decode_width
+        # 0 keeps the decoded size
+        self.display_width = display_width
+        self.model_size = model_size
+
+    @property
+    def needs_ffmpeg(self) -> bool:
+        return self.keyframes_only or self.decode_width > 0
+
+    def capture_params(self) -> list[int]:
+        """VideoCapture open parameters for OpenCV's FFmpeg backend"""
+        params = []
+        if self.hw_acceleration:
+            params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        if self.threads > 0:
+            params += [cv2.CAP_PROP_N_THREADS, self.threads]
+        return params
+
+
+def open_capture(source_type: str, source_path: str, options: DecodeOptions):
+    """FFmpegReader when the options need it and ffmpeg is installed, an OpenCV capture otherwise"""
+    if options.needs_ffmpeg:
+        if shutil.which('ffmpeg'):
+            reader = FFmpegReader(source_type, source_path, options)
+            if reader.isOpened():
+                return reader
+            reader.release()
+        else:
+            print("ffmpeg not found, decoding every frame at full size with OpenCV")
+
+    cap = cv2.VideoCapture(source_path, cv2.CAP_FFMPEG, options.capture_params())
+    if not cap.isOpened():
+        return None
+    if source_type == 'rtsp':
+        # Set buffer size to reduce latency
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+def resize_to_width(frame: np.ndarray, width: int) -> np.ndarray:
+    """Downscale to the width keeping the aspect ratio, never upscales"""
+    height, frame_width = frame.shape[:2]
+    if width <= 0 or frame_width <= width:
+        return frame
+    return cv2.resize(frame, (width, round(height * width / frame_width)), interpolation=cv2.INTER_AREA)
+
+
+def split_frame(frame: np.ndarray, display_width: int, model_size: int) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Display-sized and model-sized frames from one decoded frame, and the factor mapping model frame
+    coordinates to display frame coordinates. Both are resized from the decoded frame with INTER_AREA.
+    """
+    display = resize_to_width(frame, display_width)
+    if model_size <= 0:
+        return display, display, 1.0
+
+    height, width = frame.shape[:2]
+    if max(height, width) <= model_size:
+        model = frame
+    else:
+        scale = model_size / max(height, width)
+        model = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return display, model, display.shape[1] / model.shape[1]
+
+
+class FFmpegReader:
+    """
+    Decodes with an ffmpeg process and reads raw BGR frames from its stdout, a drop-in for the
+    VideoCapture calls FrameGrabber makes. FFmpeg can skip non-key frames without decoding them
+    and scale in the decoder's pixel format, which OpenCV's capture can't.
+    Video files are read at their native rate and looped by ffmpeg, so they need no pacing.
+    Needs ffmpeg 5.1 or newer (-fps_mode), the reader counts as opened only once ffmpeg has sent a first frame.
+    """
+
+    realtime = True
+
+    def __init__(self, source_type: str, source_path: str, options: DecodeOptions):
+        import ffmpeg
+
+        self._process = None
+        self._first = None
+        self.width = self.height = 0
+        self.fps = 0.0
+        self.source_size = None
+
+        # OpenCV reads the stream header for the size, ffprobe isn't always installed next to ffmpeg
+        probe = cv2.VideoCapture(source_path, cv2.CAP_FFMPEG)
+        if not probe.isOpened():
+            return
+        source_width = int(probe.get(cv2.CAP_PROP_FRAME_WIDTH))
+        source_height = int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = probe.get(cv2.CAP_PROP_FPS) or 0.0
+        probe.release()
+        if not source_width or not source_height:
+            return
+        self.source_size = (source_width, source_height)
+
+        self.width = options.decode_width if 0 < options.decode_width < source_width else source_width
+        # Even height, most pixel formats need it
+        self.height = round(source_height * self.width / source_width / 2) * 2
+        self._frame_size = self.width * self.height * 3
+
+        input_options = {}
+        if options.keyframes_only:
+            input_options['skip_frame'] = 'nokey'
+        if options.hw_acceleration:
+            input_options['hwaccel'] = 'auto'
+        if options.threads > 0:
+            input_options['threads'] = options.threads
+        if source_type == 'rtsp':
+            input_options['rtsp_transport'] = 'tcp'
+        else:
+            input_options['re'] = None
+            input_options['stream_loop'] = -1
+
+        self._process = (
+            ffmpeg
+            .input(source_path, **input_options)
+            .output('pipe:', format='rawvideo', pix_fmt='bgr24', vf=f'scale={self.width}:{self.height}',
+                    fps_mode='passthrough')
+            .global_args('-loglevel', 'error', '-nostdin')
+            .run_async(pipe_stdout=True)
+        )
+        # An ffmpeg that rejects an option or can't decode the source only exits, it has to be read to tell
+        ok, self._first = self.read()
+        if not ok:
+            self.release()
+
+    def isOpened(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        if self._first is not None:
+            frame, self._first = self._first, None
+            return True, frame
+        if self._process is None:
+            return False, None
+        buffer = bytearray(self._frame_size)
+        view = memoryview(buffer)
+        filled = 0
+        while filled < self._frame_size:
+            read = self._process.stdout.readinto(view[filled:])
+            if not read:
+                return False, None
+            filled += read
+        return True, np.frombuffer(buffer, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def grab(self) -> bool:
+        return self.read()[0]
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0.0
+
+    def set(self, prop: int, value: float) -> bool:
+        return False
+
+    def release(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
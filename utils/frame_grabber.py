@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from utils.decoder import DecodeOptions, split_frame
+from utils.metrics import CAPTURE_READ_SECONDS
+from utils.streaming_utils import open_media_source
+
+
+class FrameGrabber:
+    """
+    Reads a video file or RTSP stream in its own thread and keeps only the newest frame.
+    RTSP is read as fast as it arrives so OpenCV's buffer never lags behind real time,
+    video files are paced at their native frame rate and looped.
+    Each decoded frame is kept display-sized (read) and model-sized (read_model), see DecodeOptions.
+    """
+
+    def __init__(self, source_type: str, source_path: str, reconnect_delay: float = 1.0,
+                 options: Optional[DecodeOptions] = None):
+        self.source_type = source_type
+        self.source_path = source_path
+        self.reconnect_delay = reconnect_delay
+        self.options = options or DecodeOptions()
+        # (width, height) of the source before any resizing, what lane polygons are drawn on
+        self.source_size = None
+        self._read_timer = CAPTURE_READ_SECONDS.labels(source_type)
+
+        self._cap = None
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._waiters = []
+
+        self._frame = None
+        self._model_frame = None
+        self._model_scale = 1.0
+        self._seq = 0
+        self._timestamp = None
+        self._last_read_seq = 0
+
+        self.grabbed = 0
+        self.dropped = 0
+        self.failed_reads = 0
+        self.reconnects = 0
+        self.last_staleness = None
+        self._grab_times = deque(maxlen=60)
+
+    def start(self) -> bool:
+        self._cap = open_media_source(self.source_type, self.source_path, self.options)
+        if self._cap is None or isinstance(self._cap, str):
+            self._cap = None
+            return False
+        self.source_size = getattr(self._cap, 'source_size', None) or (
+            int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f'grabber-{self.source_type}', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Signal the reader thread to exit, it releases the capture itself so this never blocks"""
+        self._running = False
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _run(self):
+        every_nth = self.options.every_nth
+        frame_interval = 0
+        # An FFmpegReader reads files at their native rate itself
+        if self.source_type == 'video' and not getattr(self._cap, 'realtime', False):
+            fps = self._cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = (1 / fps if fps and fps > 0 else 1 / 30) * every_nth
+        next_frame_at = time.monotonic()
+
+        while self._running:
+            with self._read_timer.time():
+                ret, frame = self._cap.read()
+                # Skipped frames are only grabbed, never converted to BGR
+                for _ in range(every_nth - 1):
+                    if not ret or not self._cap.grab():
+                        break
+            if not ret:
+                self.failed_reads += 1
+                if not self._recover():
+                    break
+                next_frame_at = time.monotonic()
+                continue
+
+            self._publish(frame)
+
+            if frame_interval:
+                next_frame_at += frame_interval
+                delay = next_frame_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Fell behind (slow disk or CPU), don't try to catch up with a burst of frames
+                    next_frame_at = time.monotonic()
+
+        # Released here rather than in stop() so a read blocked on a dead socket never races the release
+        self._running = False
+        self._cap.release()
+
+    def _recover(self) -> bool:
+        if self.source_type == 'video' and isinstance(self._cap, cv2.VideoCapture):
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return True
+
+        # RTSP connection lost, reopen the stream until it comes back or we are stopped.
+        # An FFmpegReader loops files itself, it only ends when ffmpeg died: reopened once, then given up
+        time.sleep(self.reconnect_delay)
+        if not self._running:
+            return False
+        self._cap.release()
+        cap = open_media_source(self.source_type, self.source_path, self.options)
+        if cap is not None:
+            self._cap = cap
+            self.reconnects += 1
+        elif self.source_type == 'video':
+            print(f"Error reopening video {self.source_path}, stopping")
+            return False
+        return True
+
+    def _publish(self, frame):
+        frame, model_frame, model_scale = split_frame(frame, self.options.display_width, self.options.model_size)
+        now = time.time()
+        with self._lock:
+            if self._seq > self._last_read_seq:
+                self.dropped += 1
+            self._frame = frame
+            self._model_frame = model_frame
+            self._model_scale = model_scale
+            self._seq += 1
+            self._timestamp = now
+            self.grabbed += 1
+            self._grab_times.append(time.monotonic())
+            waiters, self._waiters = self._waiters, []
+
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def read(self) -> tuple[int, Optional[float], Optional[np.ndarray]]:
+        """Return (sequence number, capture timestamp, frame) of the newest frame"""
+        with self._lock:
+            seq, timestamp, frame = self._seq, self._timestamp, self._frame
+            if seq > self._last_read_seq:
+                self._last_read_seq = seq
+                if timestamp is not None:
+                    self.last_staleness = time.time() - timestamp
+        return seq, timestamp, frame
+
+    def read_model(self) -> tuple[int, Optional[np.ndarray], float]:
+        """
+        (sequence number, model-sized frame, factor from its coordinates to the display frame's) of the newest frame
+        """
+        with self._lock:
+            return self._seq, self._model_frame, self._model_scale
+
+    def valid(self, seq: int) -> bool:
+        """Frames are never reused, every frame read stays valid"""
+        return True
+
+    def keep(self, seq: int, frame: np.ndarray) -> np.ndarray:
+        """The frame to hold on to, each decoded frame is a new array already"""
+        return frame
+
+    async def next_frame(self, last_seq: int, timeout: float = 1.0):
+        """Wait until a frame newer than last_seq is available, returns None on timeout"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            if self._seq <= last_seq:
+                self._waiters.append((loop, event))
+        if not event.is_set() and self._seq <= last_seq:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        seq, timestamp, frame = self.read()
+        if seq <= last_seq:
+            return None
+        return seq, timestamp, frame
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            grab_times = list(self._grab_times)
+            timestamp = self._timestamp
+
+        grab_fps = 0.0
+        if len(grab_times) > 1 and grab_times[-1] > grab_times[0]:
+            grab_fps = (len(grab_times) - 1) / (grab_times[-1] - grab_times[0])
+
+        return {
+            'running': self._running,
+            'grab_fps': grab_fps,
+            'grabbed': self.grabbed,
+            'dropped': self.dropped,
+            'failed_reads': self.failed_reads,
+            'reconnects': self.reconnects,
+            'frame_age': time.time() - timestamp if timestamp is not None else None,
+            'staleness': self.last_staleness,
+        }
@@ -0,0 +1,54 @@
+import asyncio
+
+from prometheus_client import CONTENT_TYPE_LATEST, Enum, Gauge, Histogram, generate_latest
+
+# Hot path stages take microseconds to tens of milliseconds, the default buckets start at 5ms
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CAPTURE_READ_SECONDS = Histogram(
+    'traffic_capture_read_seconds', 'Time to read and decode one frame from a source',
+    ['source_type'], buckets=FAST_BUCKETS)
+JPEG_ENCODE_SECONDS = Histogram(
+    'traffic_jpeg_encode_seconds', 'Time to encode one frame as JPEG', buckets=FAST_BUCKETS)
+INFERENCE_SECONDS = Histogram(
+    'traffic_inference_seconds', 'Time of one detection call on the model, per batch',
+    ['backend'], buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0))
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'traffic_event_loop_lag_seconds', 'How late a scheduled wake-up of the event loop ran', buckets=FAST_BUCKETS)
+UI_UPDATE_SECONDS = Histogram(
+    'traffic_ui_update_seconds', 'Duration of the info panel update timer', buckets=FAST_BUCKETS)
+
+SOURCE_FPS = Gauge('traffic_source_fps', 'Frames per second read from the active source', ['source_type'])
+SOURCE_DROPPED_FRAMES = Gauge(
+    'traffic_source_dropped_frames', 'Frames of the active source replaced before anyone read them', ['source_type'])
+SOURCE_FRAME_AGE_SECONDS = Gauge(
+    'traffic_source_frame_age_seconds', 'Age of the newest frame of the active source', ['source_type'])
+LIGHT_PHASE = Enum('traffic_light_phase', 'Current color of the traffic light', states=['red', 'yellow', 'green'])
+VEHICLE_COUNT = Gauge('traffic_vehicle_count', 'Vehicles counted by the last detection')
+PHASE_MAX_SECONDS = Gauge('traffic_phase_max_seconds', 'Duration of the current phase')
+
+
+async def monitor_event_loop(interval: float = 0.25):
+    """Sleep in a loop and record how late every wake-up is, a busy loop delays every UI update and stream"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
+
+
+def update_source_gauges(source_type: str, stats: dict):
+    SOURCE_FPS.labels(source_type).set(stats['grab_fps'])
+    SOURCE_DROPPED_FRAMES.labels(source_type).set(stats['dropped'])
+    if stats['frame_age'] is not None:
+        SOURCE_FRAME_AGE_SECONDS.labels(source_type).set(stats['frame_age'])
+
+
+def clear_source_gauges():
+    for gauge in (SOURCE_FPS, SOURCE_DROPPED_FRAMES, SOURCE_FRAME_AGE_SECONDS):
+        gauge.clear()
+
+
+def metrics_payload() -> tuple[bytes, str]:
+    """Body and content type of a Prometheus scrape"""
+    return generate_latest(), CONTENT_TYPE_LATEST
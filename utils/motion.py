@@ -0,0 +1,79 @@
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Decides whether a frame is worth a new detection by comparing it with the frame the last detection ran on.
+    Frames are compared as small blurred grayscale images, so a check costs a fraction of a millisecond.
+    While the scene stays the same (empty road at night, queue standing in gridlock) the last count is still valid.
+    Comparing with the last detected frame instead of the previous one means slow changes add up and are not missed.
+    """
+
+    def __init__(self, width: int = 160, pixel_threshold: int = 25, changed_ratio: float = 0.01,
+                 max_skip_seconds: float = 30.0):
+        self.width = width
+        # Gray level difference for a pixel to count as changed, and the share of changed pixels that means motion
+        self.pixel_threshold = pixel_threshold
+        self.changed_ratio = changed_ratio
+        # Detect anyway after this long so a count never goes stale because of a missed change
+        self.max_skip_seconds = max_skip_seconds
+
+        self._reference = None
+        self._reference_time = 0.0
+
+        self.checks = 0
+        self.inferences = 0
+        self.skips = 0
+        self.last_score = None
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        small_height = max(1, round(height * self.width / width))
+        small = cv2.resize(frame, (self.width, small_height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # Sensor noise and compression artifacts shouldn't look like motion
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def score(self, frame: np.ndarray) -> Optional[float]:
+        """Share of pixels changed since the last detected frame, None if there is nothing to compare with"""
+        if self._reference is None:
+            return None
+        prepared = self._prepare(frame)
+        if prepared.shape != self._reference.shape:
+            return None
+        changed = cv2.absdiff(prepared, self._reference) > self.pixel_threshold
+        return float(np.count_nonzero(changed)) / changed.size
+
+    def should_detect(self, frame: np.ndarray) -> bool:
+        """True when the frame needs a detection, the frame then becomes the new reference"""
+        self.checks += 1
+        now = time.monotonic()
+        score = self.score(frame)
+        self.last_score = score
+
+        if score is not None and score < self.changed_ratio and now - self._reference_time < self.max_skip_seconds:
+            self.skips += 1
+            return False
+
+        self._reference = self._prepare(frame)
+        self._reference_time = now
+        self.inferences += 1
+        return True
+
+    def reset(self):
+        """Forget the reference, e.g. for a new source or when the detection on it failed"""
+        self._reference = None
+
+    def get_stats(self) -> dict:
+        return {
+            'checks': self.checks,
+            'inferences': self.inferences,
+            'skips': self.skips,
+            'skip_ratio': self.skips / self.checks if self.checks else 0.0,
+            'last_score': self.last_score,
+        }
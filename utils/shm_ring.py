@@ -0,0 +1,90 @@
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+# Header: latest sequence number, then one sequence number per slot (-1 while the slot is being written)
+_LATEST = 0
+
+
+class FrameRing:
+    """
+    Fixed-shape frames in a multiprocessing.shared_memory block, written by one process and read by any number.
+    The writer cycles through the slots and publishes each frame by its sequence number (a seqlock per slot):
+    the slot's number is set to -1 before writing and to the frame's number after, then the ring's latest number.
+    Readers get a view of the newest complete frame without copying or pickling and check with valid() after
+    using it that the writer hasn't reused the slot meanwhile. With enough slots that only happens to a reader
+    that is slower than slots frames, which then drops the result and takes the next frame.
+    Relies on aligned 8 byte stores being atomic, which holds on x86-64 and ARM64.
+    """
+
+    def __init__(self, name: Optional[str], shape: tuple, slots: int = 8, create: bool = False):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape))
+        header_bytes = 8 * (1 + slots)
+        times_bytes = 8 * slots
+
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                                   size=header_bytes + times_bytes + slots * self.frame_bytes)
+        else:
+            # Spawned processes share the server's resource tracker, only the creating process unlinks the block
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self.owner = create
+
+        buffer = self._shm.buf
+        self._header = np.ndarray((1 + slots,), dtype=np.int64, buffer=buffer)
+        self._times = np.ndarray((slots,), dtype=np.float64, buffer=buffer, offset=header_bytes)
+        self._frames = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=buffer,
+                                  offset=header_bytes + times_bytes)
+        if create:
+            self._header[:] = 0
+
+    def spec(self) -> tuple:
+        """What another process needs to attach: FrameRing(*ring.spec())"""
+        return self.name, self.shape, self.slots
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self._header[_LATEST])
+
+    def write(self, frame: np.ndarray, timestamp: float) -> int:
+        """Copy the frame into the next slot (the only copy) and publish it, returns its sequence number"""
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        self._header[1 + slot] = -1
+        self._frames[slot] = frame
+        self._times[slot] = timestamp
+        self._header[1 + slot] = seq
+        self._header[_LATEST] = seq
+        return seq
+
+    def read(self, last_seq: int = 0) -> Optional[tuple[int, float, np.ndarray]]:
+        """(sequence number, timestamp, read-only view) of the newest frame if newer than last_seq, else None"""
+        seq = self.latest_seq
+        if seq <= last_seq:
+            return None
+        slot = seq % self.slots
+        timestamp = float(self._times[slot])
+        if self._header[1 + slot] != seq:
+            # Overtaken by the writer between the two reads, the next call gets the newer frame
+            return None
+        view = self._frames[slot]
+        view.flags.writeable = False
+        return seq, timestamp, view
+
+    def valid(self, seq: int) -> bool:
+        """Whether the view read for seq still holds that frame"""
+        return self._header[1 + seq % self.slots] == seq
+
+    def close(self):
+        self._header = self._times = self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A view handed out by read() is still referenced, the mapping goes away with it
+            pass
+        if self.owner:
+            self._shm.unlink()
@@ -5,22 +5,48 @@ from typing import Optional
 import cv2
 import numpy as np
 
+from utils.decoder import DecodeOptions, open_capture
+from utils.metrics import JPEG_ENCODE_SECONDS
 
-def frame_to_base64(frame: np.ndarray) -> str:
+MJPEG_BOUNDARY = 'frame'
+
+
+def frame_to_jpeg(frame: np.ndarray, quality: int = 85) -> bytes:
+    """Encode OpenCV frame as JPEG bytes"""
+    if frame is None:
+        return b''
+    with JPEG_ENCODE_SECONDS.time():
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def frame_to_base64(frame: np.ndarray, quality: int = 85) -> str:
     """Convert OpenCV frame to base64 encoded image"""
     if frame is None:
         return ''
-    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-    return base64.b64encode(buffer).decode('utf-8')
+    return base64.b64encode(frame_to_jpeg(frame, quality)).decode('utf-8')
+
 
+def mjpeg_part(jpeg: bytes) -> bytes:
+    """Wrap an encoded JPEG as one part of a multipart/x-mixed-replace stream"""
+    return (
+        f'--{MJPEG_BOUNDARY}\r\n'
+        f'Content-Type: image/jpeg\r\n'
+        f'Content-Length: {len(jpeg)}\r\n\r\n'
+    ).encode() + jpeg + b'\r\n'
 
 
-def open_media_source(source_type: str, source_path: str) -> Optional[cv2.VideoCapture]:
-    """Open media source based on type"""
+
+def open_media_source(source_type: str, source_path: str, options: Optional[DecodeOptions] = None):
+    """Open media source based on type, video and RTSP use the decode options when given"""
     if not source_path:
         return None
 
     try:
+        if options is not None and source_type in ('rtsp', 'video'):
+            if source_type == 'video' and not Path(source_path).exists():
+                return None
+            return open_capture(source_type, source_path, options)
         if source_type == 'rtsp':
             # RTSP stream
             cap = cv2.VideoCapture(source_path, cv2.CAP_FFMPEG)
@@ -0,0 +1,276 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Kinds of record: a vehicle count (value is the count) and a color change (code is the color, value the group)
+COUNT = 0
+PHASE = 1
+COLORS = ('red', 'yellow', 'green')
+
+# 16 bytes per record: wall clock time, series id (see series_id), kind, color code, value
+RECORD = np.dtype([('time', '<f8'), ('series', '<u2'), ('kind', 'u1'), ('code', 'u1'), ('value', '<f4')])
+# Aggregate of the records of one series, kind and code in one interval, aggregates of aggregates stay exact
+ROLLUP = np.dtype([('time', '<f8'), ('series', '<u2'), ('kind', 'u1'), ('code', 'u1'), ('samples', '<u4'),
+                   ('sum', '<f8'), ('min', '<f4'), ('max', '<f4')])
+# Intervals that are a multiple of this are answered from per minute rollups, cached once a day is over
+ROLLUP_SECONDS = 60
+DAY_SECONDS = 86400
+
+
+def day_name(day: int) -> str:
+    return datetime.fromtimestamp(day * DAY_SECONDS, timezone.utc).strftime('%Y-%m-%d')
+
+
+def aggregate(rows: np.ndarray, interval: float) -> np.ndarray:
+    """Merge ROLLUP rows (or single records as rollups) of the same series, kind and code into intervals"""
+    if len(rows) == 0:
+        return np.zeros(0, dtype=ROLLUP)
+    buckets = np.floor(rows['time'] / interval).astype(np.int64)
+    # Sorted by series, then interval, so each group is one run of rows
+    order = np.lexsort((rows['code'], rows['kind'], buckets, rows['series']))
+    buckets = buckets[order]
+    rows = rows[order]
+    changed = (buckets[1:] != buckets[:-1]) | (rows['series'][1:] != rows['series'][:-1]) \
+        | (rows['kind'][1:] != rows['kind'][:-1]) | (rows['code'][1:] != rows['code'][:-1])
+    starts = np.flatnonzero(np.r_[True, changed])
+
+    result = np.zeros(len(starts), dtype=ROLLUP)
+    result['time'] = buckets[starts] * interval
+    for field in ('series', 'kind', 'code'):
+        result[field] = rows[field][starts]
+    result['samples'] = np.add.reduceat(rows['samples'], starts)
+    result['sum'] = np.add.reduceat(rows['sum'], starts)
+    result['min'] = np.minimum.reduceat(rows['min'], starts)
+    result['max'] = np.maximum.reduceat(rows['max'], starts)
+    return result
+
+
+def as_rollup(records: np.ndarray) -> np.ndarray:
+    rows = np.zeros(len(records), dtype=ROLLUP)
+    for field in ('time', 'series', 'kind', 'code'):
+        rows[field] = records[field]
+    rows['samples'] = 1
+    rows['sum'] = records['value']
+    rows['min'] = records['value']
+    rows['max'] = records['value']
+    return rows
+
+
+class TimeSeriesStore:
+    """
+    Append-only history of counts and color changes in fixed size binary records, one file per UTC day.
+    append() only queues the record, a writer thread appends the queued records to their day's file every
+    flush_interval seconds, so the controller never waits on the disk. Readers memory-map the day files.
+    A crash at worst loses the last interval, a partial record it leaves behind is ignored by readers and cut off
+    before the next append, so the records after it stay aligned.
+    Series are named ('main', 'main/lane 1') and stored by a 16 bit id, the names are kept in series.json.
+    Days older than retention_days are deleted, 0 keeps everything.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 1.0, retention_days: int = 0,
+                 max_pending: int = 100_000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / 'rollups').mkdir(exist_ok=True)
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+
+        series_path = self.directory / 'series.json'
+        self._series = json.loads(series_path.read_text()) if series_path.exists() else {}
+        self._series_dirty = False
+        self._lock = threading.Lock()
+        # Bounded, when the disk stalls the oldest records are dropped instead of growing without limit
+        self._pending = deque(maxlen=max_pending)
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+        self._pruned_day = None
+        # Day files checked for a partial record since this process started
+        self._aligned = set()
+
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+
+    def series_id(self, name: str) -> int:
+        series_id = self._series.get(name)
+        if series_id is None:
+            with self._lock:
+                series_id = self._series.get(name)
+                if series_id is None:
+                    series_id = len(self._series)
+                    if series_id > np.iinfo(RECORD['series']).max:
+                        raise ValueError("Too many series in the history store")
+                    self._series[name] = series_id
+                    self._series_dirty = True
+        return series_id
+
+    def series_names(self) -> dict[int, str]:
+        return {series_id: name for name, series_id in self._series.items()}
+
+    def append(self, series: str, kind: int, value: float, code: int = 0, timestamp: Optional[float] = None):
+        """Queue one record, timestamp is wall clock time (time.time())"""
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append((time.time() if timestamp is None else timestamp, self.series_id(series), kind, code,
+                              value))
+
+    def record_counts(self, light_id: str, count: int, lane_counts: dict[str, int]):
+        self.append(light_id, COUNT, count)
+        for lane, lane_count in lane_counts.items():
+            self.append(f'{light_id}/{lane}', COUNT, lane_count)
+
+    def record_phase(self, junction_id: str, group: int, color: str):
+        self.append(junction_id, PHASE, group, COLORS.index(color))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the writer after it has written everything queued"""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing traffic history: {e}")
+                self.error = str(e)
+
+    def flush(self):
+        count = len(self._pending)
+        # Names first, every id in a written record must already be in series.json
+        if self._series_dirty:
+            with self._lock:
+                names = dict(self._series)
+                self._series_dirty = False
+            path = self.directory / 'series.json'
+            path.with_suffix('.tmp').write_text(json.dumps(names))
+            os.replace(path.with_suffix('.tmp'), path)
+
+        if count:
+            records = np.array([self._pending.popleft() for _ in range(count)], dtype=RECORD)
+            days = np.floor(records['time'] / DAY_SECONDS).astype(np.int64)
+            for day in np.unique(days):
+                path = self.directory / f'{day_name(day)}.bin'
+                if path not in self._aligned:
+                    self._truncate_partial(path)
+                    self._aligned.add(path)
+                with open(path, 'ab') as file:
+                    file.write(records[days == day].tobytes())
+            self.written += count
+
+        today = int(time.time() // DAY_SECONDS)
+        if self.retention_days and self._pruned_day != today:
+            self._pruned_day = today
+            self.prune(today - self.retention_days)
+
+    @staticmethod
+    def _truncate_partial(path: Path):
+        """Cut off a partial record a crash left at the end of a day file"""
+        size = path.stat().st_size if path.exists() else 0
+        if size % RECORD.itemsize:
+            print(f"Truncating a partial record at the end of {path}")
+            os.truncate(path, size - size % RECORD.itemsize)
+
+    def prune(self, before_day: int):
+        cutoff = day_name(before_day)
+        for path in [*self.directory.glob('*.bin'), *(self.directory / 'rollups').glob('*.npy')]:
+            if path.stem < cutoff:
+                path.unlink()
+
+    def _segment(self, day: int) -> np.ndarray:
+        """Memory-mapped records of one day, empty when nothing was written that day"""
+        path = self.directory / f'{day_name(day)}.bin'
+        size = path.stat().st_size if path.exists() else 0
+        if size < RECORD.itemsize:
+            return np.zeros(0, dtype=RECORD)
+        return np.memmap(path, dtype=RECORD, mode='r', shape=(size // RECORD.itemsize,))
+
+    @staticmethod
+    def _select(rows: np.ndarray, start: float, end: float, series: Optional[int], kind: Optional[int]):
+        mask = (rows['time'] >= start) & (rows['time'] < end)
+        if series is not None:
+            mask &= rows['series'] == series
+        if kind is not None:
+            mask &= rows['kind'] == kind
+        return rows[mask]
+
+    def records(self, start: float, end: float, series: Optional[str] = None, kind: Optional[int] = None):
+        """Records between two wall clock times, optionally of one series and kind, in the order written"""
+        series_id = self._series.get(series) if series is not None else None
+        if series is not None and series_id is None:
+            return np.zeros(0, dtype=RECORD)
+        days = range(int(start // DAY_SECONDS), int(end // DAY_SECONDS) + 1)
+        parts = [self._select(self._segment(day), start, end, series_id, kind) for day in days]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD)
+
+    def _minute_rollups(self, day: int) -> np.ndarray:
+        """Per minute rollups of every series of one day, saved once the day is over"""
+        path = self.directory / 'rollups' / f'{day_name(day)}.npy'
+        if path.exists():
+            return np.load(path, mmap_mode='r')
+        rows = aggregate(as_rollup(self._segment(day)), ROLLUP_SECONDS)
+        # Records of the previous day may still be queued shortly after midnight
+        if (day + 1) * DAY_SECONDS < time.time() - 2 * self.flush_interval - 60:
+            np.save(path, rows)
+        return rows
+
+    def rollup(self, start: float, end: float, interval: float = 300, series: Optional[str] = None,
+               kind: Optional[int] = COUNT) -> np.ndarray:
+        """ROLLUP rows of the whole intervals from start to end, sorted by series, then time"""
+        if not interval > 0:
+            raise ValueError("interval must be positive")
+        series_id = self._series.get(series) if series is not None else None
+        if series is not None and series_id is None:
+            return np.zeros(0, dtype=ROLLUP)
+        # Aligned to the interval, a minute rollup is then either wholly inside the range or wholly outside
+        start = math.floor(start / interval) * interval
+        end = math.ceil(end / interval) * interval
+        days = range(int(start // DAY_SECONDS), int(end // DAY_SECONDS) + 1)
+        if interval % ROLLUP_SECONDS == 0:
+            parts = [self._select(self._minute_rollups(day), start, end, series_id, kind) for day in days]
+        else:
+            parts = [as_rollup(self._select(self._segment(day), start, end, series_id, kind)) for day in days]
+        return aggregate(np.concatenate(parts) if parts else np.zeros(0, dtype=ROLLUP), interval)
+
+    def query(self, series: str, start: float, end: float, interval: float = 300) -> dict:
+        """Count rollups of one series as lists, for dashboards"""
+        rows = self.rollup(start, end, interval, series, COUNT)
+        rows = rows[np.argsort(rows['time'], kind='stable')]
+        return {
+            'series': series,
+            'interval': interval,
+            'time': rows['time'].tolist(),
+            'samples': rows['samples'].tolist(),
+            'mean': (rows['sum'] / np.maximum(rows['samples'], 1)).tolist(),
+            'min': rows['min'].tolist(),
+            'max': rows['max'].tolist(),
+        }
+
+    def get_stats(self) -> dict:
+        return {
+            'directory': str(self.directory),
+            'series': len(self._series),
+            'pending': len(self._pending),
+            'written': self.written,
+            'dropped': self.dropped,
+            'error': self.error,
+        }